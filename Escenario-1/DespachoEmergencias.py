@@ -1,16 +1,131 @@
+import asyncio
+import gc
+import gzip
+from array import array
 import json
 import heapq
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+import logging
+import logging.handlers
+import math
+import multiprocessing
+import os
+import re
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple, TextIO
 import time
 import random
 import sys
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+logger = logging.getLogger(__name__)
+
+_ESPACIOS_JSON = re.compile(r'[ \t\n\r]*')
+_UMBRAL_INSERCION = 16
+_MINIMO_LLAMADAS_PARALELO = 20000
+_ANCHO_TOTAL_REPORTE = 20
+_MODOS_REPORTE = ('indentado', 'compacto', 'jsonl')
+_BUFFER_ESCRITURA = 1 << 20
+_ESPERA_SIN_DIARIO = 0.5
+# Con fork los procesos heredan las llamadas por copy-on-write y solo reciben índices de bloque
+_LLAMADAS_COMPARTIDAS: List[Any] = []
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_EPOCH_LOCAL = datetime(1970, 1, 1)
+_MICROSEGUNDO = timedelta(microseconds=1)
+
+
+def _a_epoch(momento: datetime) -> int:
+    """Convierte un datetime en microsegundos desde epoch (los timestamps sin zona se asumen UTC)"""
+    if momento.tzinfo is None:
+        momento = momento.replace(tzinfo=timezone.utc)
+    return (momento - _EPOCH_UTC) // _MICROSEGUNDO
+
+
+class _LectorJSONIncremental:
+    """Lee valores JSON de un archivo por bloques, sin cargar el documento completo en memoria"""
+
+    def __init__(self, archivo: TextIO, tamano_bloque: int = 1 << 16):
+        self.archivo = archivo
+        self.tamano_bloque = tamano_bloque
+        self.decodificador = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.linea = 1
+        self.agotado = False
+
+    def _leer_bloque(self, tamano: Optional[int] = None) -> bool:
+        """Añade un bloque al buffer descartando la parte ya consumida"""
+        if self.agotado:
+            return False
+        bloque = self.archivo.read(tamano or self.tamano_bloque)
+        if not bloque:
+            self.agotado = True
+            return False
+        self.buffer = self.buffer[self.pos:] + bloque
+        self.pos = 0
+        return True
+
+    def _avanzar(self, nueva_pos: int):
+        self.linea += self.buffer.count('\n', self.pos, nueva_pos)
+        self.pos = nueva_pos
+
+    def siguiente_caracter(self) -> str:
+        """Salta espacios y devuelve el siguiente carácter significativo sin consumirlo ('' al final)"""
+        while True:
+            self._avanzar(_ESPACIOS_JSON.match(self.buffer, self.pos).end())
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._leer_bloque():
+                return ''
+
+    def consumir(self, esperado: str):
+        caracter = self.siguiente_caracter()
+        if caracter != esperado:
+            raise ValueError(f"se esperaba '{esperado}' en línea {self.linea}, se encontró {caracter or 'fin de archivo'!r}")
+        self._avanzar(self.pos + 1)
+
+    def decodificar(self) -> Any:
+        """Decodifica el siguiente valor JSON, leyendo más bloques si el valor está incompleto"""
+        self.siguiente_caracter()
+        while True:
+            pendiente = len(self.buffer) - self.pos
+            try:
+                valor, fin = self.decodificador.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # El crecimiento geométrico evita re-decodificar valores grandes una vez por bloque
+                if self._leer_bloque(max(self.tamano_bloque, pendiente)):
+                    continue
+                raise ValueError(f"JSON inválido en línea {self.linea}: {e.msg}") from None
+            if fin == len(self.buffer) and self._leer_bloque(max(self.tamano_bloque, pendiente)):
+                # Un número al final del buffer podría continuar en el siguiente bloque
+                continue
+            self._avanzar(fin)
+            return valor
+
 
 class LlamadaEmergencia:
+    """Llamada compacta: atributos en __slots__, timestamp como epoch entero (microsegundos UTC)
+    y clave de heap precalculada (prioridad, epoch, id) que se compara en C.
+    La zona horaria original se conserva para devolver el timestamp tal como llegó"""
+
+    __slots__ = ('id', 'epoch', 'zona_horaria', 'prioridad', 'categoria', 'ubicacion', 'descripcion',
+                 '_subtareas', 'tiempo_estimado_respuesta', 'tiempo_despacho', 'clave',
+                 '_subtareas_aplanadas', '_resumen_subtareas')
+
     def __init__(self, datos_llamada: Dict[str, Any]):
         self.id = datos_llamada['id']
-        self.timestamp = datetime.fromisoformat(datos_llamada['timestamp'].replace('Z', '+00:00'))
+        momento = datetime.fromisoformat(datos_llamada['timestamp'].replace('Z', '+00:00'))
+        self.epoch = _a_epoch(momento)
+        self.zona_horaria = momento.tzinfo
         self.prioridad = datos_llamada['prioridad']
         self.categoria = datos_llamada['categoria']
         self.ubicacion = datos_llamada['ubicacion']
@@ -18,37 +133,971 @@ class LlamadaEmergencia:
         self.subtareas = datos_llamada.get('subtareas', [])
         self.tiempo_estimado_respuesta = datos_llamada.get('tiempo_estimado_respuesta', 0)
         self.tiempo_despacho = None
+        self.clave = (self.prioridad, self.epoch, self.id)
+
+    @property
+    def timestamp(self) -> datetime:
+        if self.zona_horaria is None:
+            return _EPOCH_LOCAL + timedelta(microseconds=self.epoch)
+        return (_EPOCH_UTC + timedelta(microseconds=self.epoch)).astimezone(self.zona_horaria)
 
     def __lt__(self, otro):
-        if self.prioridad != otro.prioridad:
-            return self.prioridad < otro.prioridad
-        elif self.timestamp != otro.timestamp:
-            return self.timestamp < otro.timestamp
-        else:
-            return self.id < otro.id
+        return self.clave < otro.clave
+
+    def a_diccionario(self) -> Dict[str, Any]:
+        """Datos de entrada equivalentes, para reconstruir la llamada (journal y snapshots)"""
+        return {
+            'id': self.id,
+            'timestamp': self.timestamp.isoformat(),
+            'prioridad': self.prioridad,
+            'categoria': self.categoria,
+            'ubicacion': self.ubicacion,
+            'descripcion': self.descripcion,
+            'subtareas': self._subtareas,
+            'tiempo_estimado_respuesta': self.tiempo_estimado_respuesta
+        }
 
-    def aplanar_subtareas(self, subtareas=None, ruta="") -> List[Dict[str, Any]]:
-        """Aplana recursivamente todas las subtareas con sus rutas"""
+    def cambiar_prioridad(self, prioridad: int):
+        """Actualiza la prioridad y recalcula la clave de heap"""
+        self.prioridad = prioridad
+        self.clave = (prioridad, self.epoch, self.id)
+
+    @property
+    def subtareas(self) -> List[Dict[str, Any]]:
+        return self._subtareas
+
+    @subtareas.setter
+    def subtareas(self, subtareas: List[Dict[str, Any]]):
+        self._subtareas = subtareas
+        self.invalidar_subtareas()
+
+    def invalidar_subtareas(self):
+        """Descarta la caché de subtareas (necesario si la lista se modifica en sitio)"""
+        self._subtareas_aplanadas = None
+        self._resumen_subtareas = None
+
+    def iterar_subtareas(self, subtareas=None, ruta="") -> Iterator[Dict[str, Any]]:
+        """Recorre las subtareas en preorden con una pila explícita, sin límite de recursión"""
         if subtareas is None:
-            subtareas = self.subtareas
+            subtareas = self._subtareas
 
-        aplanadas = []
-        for i, subtarea in enumerate(subtareas):
-            ruta_actual = f"{ruta}/{i}" if ruta else str(i)
-            aplanadas.append({
+        pila = [(iter(enumerate(subtareas)), ruta)]
+        while pila:
+            iterador, ruta_padre = pila[-1]
+            siguiente = next(iterador, None)
+            if siguiente is None:
+                pila.pop()
+                continue
+
+            i, subtarea = siguiente
+            ruta_actual = f"{ruta_padre}/{i}" if ruta_padre else str(i)
+            yield {
                 'tipo': subtarea['tipo'],
                 'recurso_estimado': subtarea['recurso_estimado'],
                 'ruta': ruta_actual
-            })
-            aplanadas.extend(self.aplanar_subtareas(subtarea.get('subtareas', []), ruta_actual))
-        return aplanadas
+            }
+            hijas = subtarea.get('subtareas')
+            if hijas:
+                pila.append((iter(enumerate(hijas)), ruta_actual))
 
+    def aplanar_subtareas(self, subtareas=None, ruta="") -> List[Dict[str, Any]]:
+        """Aplana todas las subtareas con sus rutas; sin argumentos usa la caché de la llamada, que guarda
+        tuplas inmutables: cada llamada recibe una lista nueva que puede modificar sin afectar a la caché"""
+        if subtareas is not None or ruta:
+            return list(self.iterar_subtareas(subtareas, ruta))
+
+        if self._subtareas_aplanadas is None:
+            self._aplanar_en_cache()
+        return [{'tipo': tipo, 'recurso_estimado': recurso, 'ruta': ruta_subtarea}
+                for tipo, recurso, ruta_subtarea in self._subtareas_aplanadas]
+
+    def _aplanar_en_cache(self):
+        aplanadas = []
+        recurso_por_tipo = {}
+        for subtarea in self.iterar_subtareas():
+            tipo = subtarea['tipo']
+            aplanadas.append((tipo, subtarea['recurso_estimado'], subtarea['ruta']))
+            recurso_por_tipo[tipo] = recurso_por_tipo.get(tipo, 0) + subtarea['recurso_estimado']
+        self._subtareas_aplanadas = tuple(aplanadas)
+        self._resumen_subtareas = (len(aplanadas), recurso_por_tipo)
+
+    def resumen_subtareas(self) -> Dict[str, Any]:
+        """Total de subtareas y suma de recurso_estimado por tipo, calculados junto con el aplanamiento"""
+        if self._resumen_subtareas is None:
+            self._aplanar_en_cache()
+        total, recurso_por_tipo = self._resumen_subtareas
+        return {'total': total, 'recurso_por_tipo': dict(recurso_por_tipo)}
+
+
+class ColaPrioridadIndexada:
+    """Min-heap de llamadas con mapa id→posición para repriorizar y cancelar por id en O(log n).
+    Cada entrada es (clave, llamada); el orden es el de LlamadaEmergencia.clave: prioridad, timestamp, id"""
+
+    def __init__(self):
+        self._heap: List[Tuple[tuple, LlamadaEmergencia]] = []
+        self._posiciones: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, id_llamada: str) -> bool:
+        return id_llamada in self._posiciones
+
+    def __iter__(self) -> Iterator[LlamadaEmergencia]:
+        """Itera las llamadas encoladas en orden de heap (no ordenado)"""
+        return (llamada for _, llamada in self._heap)
+
+    def obtener(self, id_llamada: str) -> Optional[LlamadaEmergencia]:
+        posicion = self._posiciones.get(id_llamada)
+        return None if posicion is None else self._heap[posicion][1]
+
+    def agregar(self, llamada: LlamadaEmergencia):
+        if llamada.id in self._posiciones:
+            raise ValueError(f"La llamada {llamada.id} ya está en la cola")
+        self._heap.append((llamada.clave, llamada))
+        self._posiciones[llamada.id] = len(self._heap) - 1
+        self._subir(len(self._heap) - 1)
+
+    def extender(self, llamadas: List[LlamadaEmergencia]):
+        """Agrega varias llamadas y reconstruye el heap en O(n); si alguna está repetida no agrega ninguna"""
+        llamadas = list(llamadas)
+        vistas = set()
+        for llamada in llamadas:
+            if llamada.id in self._posiciones or llamada.id in vistas:
+                raise ValueError(f"La llamada {llamada.id} ya está en la cola")
+            vistas.add(llamada.id)
+
+        for llamada in llamadas:
+            self._posiciones[llamada.id] = len(self._heap)
+            self._heap.append((llamada.clave, llamada))
+        for i in reversed(range(len(self._heap) // 2)):
+            self._bajar(i)
+
+    def ver_siguiente(self) -> Optional[LlamadaEmergencia]:
+        return self._heap[0][1] if self._heap else None
+
+    def extraer(self) -> LlamadaEmergencia:
+        if not self._heap:
+            raise IndexError("Cola de prioridad vacía")
+        return self._quitar(0)
+
+    def eliminar(self, id_llamada: str) -> Optional[LlamadaEmergencia]:
+        posicion = self._posiciones.get(id_llamada)
+        if posicion is None:
+            return None
+        return self._quitar(posicion)
+
+    def actualizar_prioridad(self, id_llamada: str, prioridad: int) -> bool:
+        """Cambia la prioridad de una llamada encolada (decrease-key / increase-key)"""
+        posicion = self._posiciones.get(id_llamada)
+        if posicion is None:
+            return False
+        clave_anterior, llamada = self._heap[posicion]
+        llamada.cambiar_prioridad(prioridad)
+        self._heap[posicion] = (llamada.clave, llamada)
+        if llamada.clave < clave_anterior:
+            self._subir(posicion)
+        else:
+            self._bajar(posicion)
+        return True
+
+    def _quitar(self, posicion: int) -> LlamadaEmergencia:
+        _, llamada = self._heap[posicion]
+        ultima = self._heap.pop()
+        del self._posiciones[llamada.id]
+        if posicion < len(self._heap):
+            self._heap[posicion] = ultima
+            self._posiciones[ultima[1].id] = posicion
+            if ultima[0] < llamada.clave:
+                self._subir(posicion)
+            else:
+                self._bajar(posicion)
+        return llamada
+
+    def _subir(self, posicion: int):
+        heap, posiciones = self._heap, self._posiciones
+        entrada = heap[posicion]
+        while posicion > 0:
+            padre = (posicion - 1) >> 1
+            entrada_padre = heap[padre]
+            if not entrada[0] < entrada_padre[0]:
+                break
+            heap[posicion] = entrada_padre
+            posiciones[entrada_padre[1].id] = posicion
+            posicion = padre
+        heap[posicion] = entrada
+        posiciones[entrada[1].id] = posicion
+
+    def _bajar(self, posicion: int):
+        heap, posiciones = self._heap, self._posiciones
+        total = len(heap)
+        entrada = heap[posicion]
+        hijo = 2 * posicion + 1
+        while hijo < total:
+            derecho = hijo + 1
+            if derecho < total and heap[derecho][0] < heap[hijo][0]:
+                hijo = derecho
+            if not heap[hijo][0] < entrada[0]:
+                break
+            heap[posicion] = heap[hijo]
+            posiciones[heap[hijo][1].id] = posicion
+            posicion = hijo
+            hijo = 2 * posicion + 1
+        heap[posicion] = entrada
+        posiciones[entrada[1].id] = posicion
+
+
+class ColaPrioridadParticionada:
+    """Una ColaPrioridadIndexada por zona (ubicacion o cubeta hash de la ubicacion) y un heap de cabezas
+    que fusiona las zonas en el orden global de prioridad. Las entradas obsoletas del heap de cabezas
+    se descartan de forma perezosa al consultarlo.
+    Es solo un particionado: permite despachar una zona concreta (despachar_siguiente_emergencia(zona))
+    sin recorrer las demás, pero todo ocurre en el mismo proceso y no escala con más núcleos. Drenar
+    todas las zonas cuesta lo mismo que el heap único más el mantenimiento del heap de cabezas"""
+
+    def __init__(self, cubetas: Optional[int] = None):
+        self.cubetas = cubetas
+        self.zonas: Dict[Any, ColaPrioridadIndexada] = {}
+        self._zona_de: Dict[str, Any] = {}
+        self._cabezas: List[Tuple[tuple, Any]] = []
+
+    def __len__(self) -> int:
+        return len(self._zona_de)
+
+    def __contains__(self, id_llamada: str) -> bool:
+        return id_llamada in self._zona_de
+
+    def __iter__(self) -> Iterator[LlamadaEmergencia]:
+        for cola in self.zonas.values():
+            yield from cola
+
+    def zona_de_llamada(self, llamada: LlamadaEmergencia) -> Any:
+        if self.cubetas is None:
+            return llamada.ubicacion
+        # crc32 es estable entre ejecuciones (p. ej. al recuperar el diario), a diferencia de hash()
+        return zlib.crc32(llamada.ubicacion.encode('utf-8')) % self.cubetas
+
+    def obtener(self, id_llamada: str) -> Optional[LlamadaEmergencia]:
+        zona = self._zona_de.get(id_llamada)
+        return None if zona is None else self.zonas[zona].obtener(id_llamada)
+
+    def agregar(self, llamada: LlamadaEmergencia):
+        if llamada.id in self._zona_de:
+            raise ValueError(f"La llamada {llamada.id} ya está en la cola")
+        zona = self.zona_de_llamada(llamada)
+        cola = self.zonas.get(zona)
+        if cola is None:
+            cola = self.zonas[zona] = ColaPrioridadIndexada()
+        cola.agregar(llamada)
+        self._zona_de[llamada.id] = zona
+        if cola.ver_siguiente() is llamada:
+            self._publicar_cabeza(zona)
+
+    def extender(self, llamadas: List[LlamadaEmergencia]):
+        por_zona: Dict[Any, List[LlamadaEmergencia]] = {}
+        vistas = set()
+        for llamada in llamadas:
+            if llamada.id in self._zona_de or llamada.id in vistas:
+                raise ValueError(f"La llamada {llamada.id} ya está en la cola")
+            vistas.add(llamada.id)
+            por_zona.setdefault(self.zona_de_llamada(llamada), []).append(llamada)
+        for zona, llamadas_zona in por_zona.items():
+            cola = self.zonas.get(zona)
+            if cola is None:
+                cola = self.zonas[zona] = ColaPrioridadIndexada()
+            cola.extender(llamadas_zona)
+            for llamada in llamadas_zona:
+                self._zona_de[llamada.id] = zona
+            self._publicar_cabeza(zona)
+
+    def ver_siguiente(self, zona: Any = None) -> Optional[LlamadaEmergencia]:
+        if zona is not None:
+            cola = self.zonas.get(zona)
+            return cola.ver_siguiente() if cola else None
+        zona = self._zona_cabeza_global()
+        return None if zona is None else self.zonas[zona].ver_siguiente()
+
+    def extraer(self, zona: Any = None) -> LlamadaEmergencia:
+        """Extrae la llamada de mayor prioridad de una zona o, sin zona, de todas las zonas"""
+        if zona is None:
+            zona = self._zona_cabeza_global()
+            if zona is None:
+                raise IndexError("Cola de prioridad vacía")
+        cola = self.zonas.get(zona)
+        if not cola:
+            raise IndexError(f"Cola de la zona {zona} vacía")
+        llamada = cola.extraer()
+        del self._zona_de[llamada.id]
+        self._publicar_cabeza(zona)
+        return llamada
+
+    def eliminar(self, id_llamada: str) -> Optional[LlamadaEmergencia]:
+        zona = self._zona_de.pop(id_llamada, None)
+        if zona is None:
+            return None
+        llamada = self.zonas[zona].eliminar(id_llamada)
+        self._publicar_cabeza(zona)
+        return llamada
+
+    def actualizar_prioridad(self, id_llamada: str, prioridad: int) -> bool:
+        zona = self._zona_de.get(id_llamada)
+        if zona is None:
+            return False
+        self.zonas[zona].actualizar_prioridad(id_llamada, prioridad)
+        self._publicar_cabeza(zona)
+        return True
+
+    def vaciar(self):
+        self.zonas.clear()
+        self._zona_de.clear()
+        self._cabezas.clear()
+
+    def _publicar_cabeza(self, zona: Any):
+        cabeza = self.zonas[zona].ver_siguiente()
+        if cabeza is not None:
+            heapq.heappush(self._cabezas, (cabeza.clave, zona))
+        if len(self._cabezas) > 4 * len(self.zonas) + 64:
+            self._cabezas = [(cola.ver_siguiente().clave, zona) for zona, cola in self.zonas.items() if cola]
+            heapq.heapify(self._cabezas)
+
+    def _zona_cabeza_global(self) -> Any:
+        while self._cabezas:
+            clave, zona = self._cabezas[0]
+            cabeza = self.zonas[zona].ver_siguiente()
+            if cabeza is not None and cabeza.clave == clave:
+                return zona
+            heapq.heappop(self._cabezas)
+        return None
+
+
+class DiarioDespacho:
+    """Journal append-only (JSONL) de eventos de la cola: encolar, despachar, reprioritizar y cancelar.
+    Las escrituras se sincronizan con fsync por lotes (cada N eventos o cada T segundos), así que tras
+    una caída solo puede perderse el último lote. El límite de T segundos se comprueba al registrar cada
+    evento; para que también se cumpla cuando no llegan más eventos tras una ráfaga hay que llamar
+    periódicamente a sincronizar_si_vencido (el modo servicio lo hace con una tarea propia). Los snapshots guardan la cola viva en JSON compacto
+    comprimido junto con la secuencia del último evento incluido, y el journal se trunca: la recuperación
+    carga el snapshot y reproduce únicamente los eventos posteriores. Las llamadas despachadas no entran
+    en el snapshot: se anexan al historial (JSONL) y el snapshot guarda hasta qué byte es válido, desde qué
+    línea lo conserva la bitácora y el byte inicial de cada lote anexado desde esa línea, para que al
+    recuperar solo se lea la cola retenida del historial"""
+
+    ARCHIVO_JOURNAL = 'journal.jsonl'
+    ARCHIVO_SNAPSHOT = 'snapshot.json.gz'
+    ARCHIVO_HISTORIAL = 'despachadas.jsonl'
+
+    def __init__(self, directorio: str, eventos_por_fsync: int = 256, segundos_por_fsync: float = 0.05,
+                 eventos_por_snapshot: int = 100000):
+        self.directorio = directorio
+        self.eventos_por_fsync = eventos_por_fsync
+        self.segundos_por_fsync = segundos_por_fsync
+        self.eventos_por_snapshot = eventos_por_snapshot
+        self.secuencia = 0
+        self.eventos_desde_snapshot = 0
+        self.tamano_historial = 0
+        self.lineas_historial = 0
+        self.primera_linea_retenida = 0
+        # [línea inicial, byte inicial] de cada lote anexado que aún contiene filas retenidas
+        self._marcas_historial: List[List[int]] = []
+        self._pendientes = 0
+        self._ultimo_fsync = time.monotonic()
+        self._archivo = None
+        os.makedirs(directorio, exist_ok=True)
+
+    @property
+    def ruta_journal(self) -> str:
+        return os.path.join(self.directorio, self.ARCHIVO_JOURNAL)
+
+    @property
+    def ruta_snapshot(self) -> str:
+        return os.path.join(self.directorio, self.ARCHIVO_SNAPSHOT)
+
+    @property
+    def ruta_historial(self) -> str:
+        return os.path.join(self.directorio, self.ARCHIVO_HISTORIAL)
+
+    def recuperar(self) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Devuelve (snapshot, eventos posteriores al snapshot) y deja el journal abierto para anexar.
+        Una última línea incompleta (escritura interrumpida) se descarta y se trunca, igual que la cola
+        del historial que no llegó a quedar cubierta por un snapshot"""
+        snapshot = None
+        if os.path.exists(self.ruta_snapshot):
+            with gzip.open(self.ruta_snapshot, 'rt', encoding='utf-8') as archivo:
+                snapshot = json.load(archivo)
+            self.secuencia = snapshot['seq']
+
+        if snapshot is not None:
+            self.tamano_historial = snapshot['historial']
+            self.lineas_historial = snapshot['lineas_historial']
+            self.primera_linea_retenida = snapshot['primera_linea_retenida']
+            self._marcas_historial = snapshot['marcas_historial']
+        if os.path.exists(self.ruta_historial):
+            with open(self.ruta_historial, 'r+b') as archivo:
+                archivo.truncate(self.tamano_historial)
+
+        eventos = []
+        if os.path.exists(self.ruta_journal):
+            with open(self.ruta_journal, 'rb') as archivo:
+                posicion_valida = 0
+                for linea in archivo:
+                    try:
+                        evento = json.loads(linea)
+                    except ValueError:
+                        break
+                    if not linea.endswith(b'\n'):
+                        break
+                    posicion_valida += len(linea)
+                    if evento['seq'] > self.secuencia:
+                        eventos.append(evento)
+                        self.secuencia = evento['seq']
+            with open(self.ruta_journal, 'r+b') as archivo:
+                archivo.truncate(posicion_valida)
+
+        self.eventos_desde_snapshot = len(eventos)
+        self._archivo = open(self.ruta_journal, 'a', encoding='utf-8')
+        return snapshot, eventos
+
+    def registrar(self, operacion: str, **datos):
+        self.secuencia += 1
+        evento = {'seq': self.secuencia, 'op': operacion, **datos}
+        self._archivo.write(json.dumps(evento, separators=(',', ':'), ensure_ascii=False) + '\n')
+        self._pendientes += 1
+        self.eventos_desde_snapshot += 1
+        if (self._pendientes >= self.eventos_por_fsync
+                or time.monotonic() - self._ultimo_fsync >= self.segundos_por_fsync):
+            self.sincronizar()
+
+    def segundos_hasta_fsync(self) -> float:
+        """Tiempo que falta para que venza el lote pendiente (T si no hay eventos pendientes)"""
+        if not self._pendientes:
+            return self.segundos_por_fsync
+        return max(0.0, self._ultimo_fsync + self.segundos_por_fsync - time.monotonic())
+
+    def sincronizar_si_vencido(self):
+        if self._pendientes and self.segundos_hasta_fsync() == 0:
+            self.sincronizar()
+
+    def sincronizar(self):
+        """Fuerza a disco los eventos pendientes del lote actual"""
+        if self._archivo is None or not self._pendientes:
+            return
+        self._archivo.flush()
+        os.fsync(self._archivo.fileno())
+        self._pendientes = 0
+        self._ultimo_fsync = time.monotonic()
+
+    def iterar_historial(self) -> Iterator[Any]:
+        """Entradas retenidas del historial (desde primera_linea_retenida), en orden de despacho: salta
+        al lote que la contiene y descarta solo las líneas previas de ese lote"""
+        if not self._marcas_historial or not os.path.exists(self.ruta_historial):
+            return
+        linea_marca, byte_marca = self._marcas_historial[0]
+        for marca in self._marcas_historial:
+            if marca[0] > self.primera_linea_retenida:
+                break
+            linea_marca, byte_marca = marca
+
+        with open(self.ruta_historial, 'rb') as archivo:
+            archivo.seek(byte_marca)
+            for _ in range(self.primera_linea_retenida - linea_marca):
+                archivo.readline()
+            for linea in archivo:
+                yield json.loads(linea)
+
+    def guardar_snapshot(self, estado: Dict[str, Any], historial_nuevo: List[Any] = (),
+                         filas_retenidas: Optional[int] = None):
+        """Anexa historial_nuevo al historial, escribe el snapshot de forma atómica (archivo temporal +
+        os.replace) y trunca el journal. filas_retenidas es cuántas de las últimas líneas del historial
+        conserva la bitácora (None: todas). Si hay una caída antes del os.replace, lo anexado queda fuera
+        del tamaño registrado en el snapshot anterior y se descarta al recuperar"""
+        self.sincronizar()
+        marcas = list(self._marcas_historial)
+        if historial_nuevo:
+            marcas.append([self.lineas_historial, self.tamano_historial])
+        lineas_historial = self.lineas_historial + len(historial_nuevo)
+        if filas_retenidas is None:
+            primera_linea_retenida = 0
+        else:
+            primera_linea_retenida = max(0, lineas_historial - filas_retenidas)
+        while len(marcas) > 1 and marcas[1][0] <= primera_linea_retenida:
+            marcas.pop(0)
+
+        with open(self.ruta_historial, 'a', encoding='utf-8') as archivo:
+            # Descarta lo anexado por un snapshot anterior que falló antes de completarse
+            archivo.truncate(self.tamano_historial)
+            archivo.write(''.join(json.dumps(entrada, separators=(',', ':'), ensure_ascii=False) + '\n'
+                                  for entrada in historial_nuevo))
+            archivo.flush()
+            os.fsync(archivo.fileno())
+            tamano_historial = archivo.tell()
+
+        temporal = self.ruta_snapshot + '.tmp'
+        with gzip.open(temporal, 'wt', encoding='utf-8') as archivo:
+            json.dump({'seq': self.secuencia, 'historial': tamano_historial, 'lineas_historial': lineas_historial,
+                       'primera_linea_retenida': primera_linea_retenida, 'marcas_historial': marcas, **estado},
+                      archivo, separators=(',', ':'), ensure_ascii=False)
+        with open(temporal, 'rb') as archivo:
+            os.fsync(archivo.fileno())
+        os.replace(temporal, self.ruta_snapshot)
+        self.tamano_historial = tamano_historial
+        self.lineas_historial = lineas_historial
+        self.primera_linea_retenida = primera_linea_retenida
+        self._marcas_historial = marcas
+
+        # Si hay una caída antes de truncar, los eventos con seq <= snapshot se ignoran al recuperar
+        self._archivo.close()
+        self._archivo = open(self.ruta_journal, 'w', encoding='utf-8')
+        os.fsync(self._archivo.fileno())
+        self.eventos_desde_snapshot = 0
+
+    def cerrar(self):
+        if self._archivo is not None:
+            self.sincronizar()
+            self._archivo.close()
+            self._archivo = None
+
+
+class HistogramaLatencia:
+    """Histograma logarítmico de latencias en nanosegundos: 16 sub-cubetas por potencia de dos
+    (error relativo < 6.25%) en un diccionario disperso, con memoria constante por operación"""
+
+    __slots__ = ('cubetas', 'conteo', 'total_ns', 'maximo_ns')
 
-class SistemaDespachoEmergencias:
     def __init__(self):
-        self.cola_prioridad = []
-        self.llamadas_despachadas = []
-        self.registro = []
+        self.cubetas: Dict[int, int] = {}
+        self.conteo = 0
+        self.total_ns = 0
+        self.maximo_ns = 0
+
+    def registrar(self, valor_ns: int):
+        desplazamiento = max(valor_ns.bit_length() - 5, 0)
+        indice = (desplazamiento << 4) + (valor_ns >> desplazamiento)
+        self.cubetas[indice] = self.cubetas.get(indice, 0) + 1
+        self.conteo += 1
+        self.total_ns += valor_ns
+        if valor_ns > self.maximo_ns:
+            self.maximo_ns = valor_ns
+
+    @staticmethod
+    def _limite_inferior(indice: int) -> int:
+        if indice < 32:
+            return indice
+        desplazamiento = (indice >> 4) - 1
+        return ((indice & 15) | 16) << desplazamiento
+
+    def percentil(self, percentil: float) -> int:
+        if not self.conteo:
+            return 0
+        objetivo = max(1, math.ceil(self.conteo * percentil / 100))
+        acumulado = 0
+        for indice in sorted(self.cubetas):
+            acumulado += self.cubetas[indice]
+            if acumulado >= objetivo:
+                return min(self._limite_inferior(indice), self.maximo_ns)
+        return self.maximo_ns
+
+    def resumen(self) -> Dict[str, Any]:
+        return {
+            'conteo': self.conteo,
+            'media_ns': self.total_ns // self.conteo if self.conteo else 0,
+            'p50_ns': self.percentil(50),
+            'p99_ns': self.percentil(99),
+            'max_ns': self.maximo_ns
+        }
+
+
+class SumideroMemoria:
+    """Conserva en memoria los resúmenes emitidos"""
+
+    def __init__(self):
+        self.resumenes: List[Dict[str, Any]] = []
+
+    def emitir(self, resumen: Dict[str, Any]):
+        self.resumenes.append(resumen)
+
+
+class SumideroJSON:
+    """Escribe el último resumen emitido en un archivo JSON"""
+
+    def __init__(self, nombre_archivo: str):
+        self.nombre_archivo = nombre_archivo
+
+    def emitir(self, resumen: Dict[str, Any]):
+        with open(self.nombre_archivo, 'w', encoding='utf-8') as archivo:
+            json.dump(resumen, archivo, indent=2, ensure_ascii=False)
+
+
+class SumideroLog:
+    """Emite cada resumen como una línea JSON en un logger"""
+
+    def __init__(self, registrador: logging.Logger = logger, nivel: int = logging.INFO):
+        self.registrador = registrador
+        self.nivel = nivel
+
+    def emitir(self, resumen: Dict[str, Any]):
+        self.registrador.log(self.nivel, "Métricas: %s", json.dumps(resumen, ensure_ascii=False))
+
+
+class Instrumentacion:
+    """Histogramas de latencia (perf_counter_ns) y contadores de las operaciones calientes del despacho.
+    Desactivada (SistemaDespachoEmergencias.instrumentacion = None) solo cuesta una comparación por operación"""
+
+    def __init__(self, sumidero: Optional[Any] = None):
+        self.sumidero = sumidero if sumidero is not None else SumideroMemoria()
+        self.histogramas: Dict[str, HistogramaLatencia] = {}
+        self.contadores: Dict[str, int] = {}
+
+    def registrar(self, operacion: str, duracion_ns: int):
+        histograma = self.histogramas.get(operacion)
+        if histograma is None:
+            histograma = self.histogramas[operacion] = HistogramaLatencia()
+        histograma.registrar(duracion_ns)
+
+    def incrementar(self, contador: str, cantidad: int = 1):
+        self.contadores[contador] = self.contadores.get(contador, 0) + cantidad
+
+    @contextmanager
+    def medir(self, operacion: str):
+        inicio = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.registrar(operacion, time.perf_counter_ns() - inicio)
+
+    def resumen(self) -> Dict[str, Any]:
+        return {
+            'latencias': {operacion: histograma.resumen() for operacion, histograma in self.histogramas.items()},
+            'contadores': dict(self.contadores)
+        }
+
+    def emitir(self) -> Dict[str, Any]:
+        resumen = self.resumen()
+        self.sumidero.emitir(resumen)
+        return resumen
+
+
+def configurar_registro(nivel: int = logging.INFO, capacidad_buffer: int = 1000):
+    """Envía los mensajes por llamada a stdout a través de un buffer: se vuelcan cada capacidad_buffer
+    registros, ante un WARNING o con vaciar_registro(). Con nivel WARNING se silencian los mensajes por llamada"""
+    destino = logging.StreamHandler(sys.stdout)
+    destino.setFormatter(logging.Formatter('%(message)s'))
+    buffer = logging.handlers.MemoryHandler(capacidad_buffer, flushLevel=logging.WARNING, target=destino)
+    for manejador in list(logger.handlers):
+        logger.removeHandler(manejador)
+        manejador.close()
+    logger.addHandler(buffer)
+    logger.setLevel(nivel)
+    logger.propagate = False
+
+
+def vaciar_registro():
+    for manejador in logger.handlers:
+        manejador.flush()
+
+
+class _SegmentoBitacora:
+    """Bloque de filas de la bitácora almacenado por columnas en arrays compactos. Las columnas con valores
+    de entrada (prioridad y tiempo de respuesta) pasan a ser listas si algún valor no cabe en el array"""
+
+    __slots__ = ('ids_datos', 'ids_fin', 'ids_no_texto', 'prioridades', 'epochs_despacho', 'epochs_llamada',
+                 'tiempos_respuesta', 'categorias', 'ubicaciones', 'llamadas')
+
+    def __init__(self, conservar_llamadas: bool):
+        self.ids_datos = bytearray()
+        self.ids_fin = array('I')
+        # Ids que no son cadenas (p. ej. enteros), por índice, para devolverlos con su tipo original
+        self.ids_no_texto: Optional[Dict[int, Any]] = None
+        self.prioridades = array('q')
+        self.epochs_despacho = array('q')
+        self.epochs_llamada = array('q')
+        self.tiempos_respuesta = array('d')
+        self.categorias = array('I')
+        self.ubicaciones = array('I')
+        self.llamadas: Optional[List[LlamadaEmergencia]] = [] if conservar_llamadas else None
+
+    def __len__(self) -> int:
+        return len(self.ids_fin)
+
+    def id_en(self, indice: int) -> Any:
+        if self.ids_no_texto is not None and indice in self.ids_no_texto:
+            return self.ids_no_texto[indice]
+        inicio = self.ids_fin[indice - 1] if indice else 0
+        return self.ids_datos[inicio:self.ids_fin[indice]].decode('utf-8')
+
+    def anexar(self, id_llamada: Any, id_bytes: bytes, prioridad: Any, epoch_despacho: int, epoch_llamada: int,
+               tiempo_respuesta: Any, categoria: int, ubicacion: int, llamada: LlamadaEmergencia):
+        """Agrega una fila completa; los valores ya vienen calculados, así que no puede quedar a medias"""
+        try:
+            self.prioridades.append(prioridad)
+        except (TypeError, OverflowError):
+            self.prioridades = list(self.prioridades)
+            self.prioridades.append(prioridad)
+        try:
+            self.tiempos_respuesta.append(tiempo_respuesta)
+        except (TypeError, OverflowError):
+            self.tiempos_respuesta = list(self.tiempos_respuesta)
+            self.tiempos_respuesta.append(tiempo_respuesta)
+
+        if not isinstance(id_llamada, str):
+            if self.ids_no_texto is None:
+                self.ids_no_texto = {}
+            self.ids_no_texto[len(self.ids_fin)] = id_llamada
+        self.ids_datos += id_bytes
+        self.ids_fin.append(len(self.ids_datos))
+        self.epochs_despacho.append(epoch_despacho)
+        self.epochs_llamada.append(epoch_llamada)
+        self.categorias.append(categoria)
+        self.ubicaciones.append(ubicacion)
+        if self.llamadas is not None:
+            self.llamadas.append(llamada)
+
+
+class BitacoraDespachos:
+    """Historial de despachos columnar y acotado: ids, prioridades, epochs y códigos internados de
+    categoría y ubicación en arrays por segmento. La retención puede ser un anillo de filas
+    (retencion_filas) o una ventana de tiempo de despacho (retencion_segundos); los segmentos más
+    antiguos se vuelcan a un archivo JSONL (archivo_derrame) o se descartan.
+    La retención descarta segmentos completos, así que se conservan entre retencion_filas y
+    retencion_filas + filas_por_segmento - 1 filas; con retencion_filas el segmento se reduce a un
+    octavo de la retención para que el exceso no pase de ~12%.
+    Sin conservar_llamadas solo quedan las columnas (no los objetos LlamadaEmergencia), de modo que
+    la memoria se mantiene acotada por la retención; los reportes necesitan las llamadas conservadas"""
+
+    def __init__(self, retencion_filas: Optional[int] = None, retencion_segundos: Optional[float] = None,
+                 archivo_derrame: Optional[str] = None, filas_por_segmento: int = 4096,
+                 conservar_llamadas: bool = True):
+        self.retencion_filas = retencion_filas
+        self.retencion_segundos = retencion_segundos
+        self.archivo_derrame = archivo_derrame
+        if retencion_filas is not None:
+            filas_por_segmento = min(filas_por_segmento, max(1, retencion_filas // 8))
+        self.filas_por_segmento = filas_por_segmento
+        self.conservar_llamadas = conservar_llamadas
+        self.segmentos: deque = deque()
+        self.filas_retenidas = 0
+        self.filas_derramadas = 0
+        self._categorias: List[str] = []
+        self._codigos_categoria: Dict[str, int] = {}
+        self._ubicaciones: List[str] = []
+        self._codigos_ubicacion: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return self.filas_retenidas
+
+    @property
+    def total_despachadas(self) -> int:
+        return self.filas_retenidas + self.filas_derramadas
+
+    @staticmethod
+    def _internar(valor: str, valores: List[str], codigos: Dict[str, int]) -> int:
+        codigo = codigos.get(valor)
+        if codigo is None:
+            codigo = codigos[valor] = len(valores)
+            valores.append(valor)
+        return codigo
+
+    def agregar(self, llamada: LlamadaEmergencia):
+        # Todo lo que puede fallar se calcula antes de tocar las columnas, que siempre quedan alineadas
+        id_bytes = str(llamada.id).encode('utf-8')
+        epoch_despacho = _a_epoch(llamada.tiempo_despacho)
+        categoria = self._internar(llamada.categoria, self._categorias, self._codigos_categoria)
+        ubicacion = self._internar(llamada.ubicacion, self._ubicaciones, self._codigos_ubicacion)
+
+        if not self.segmentos or len(self.segmentos[-1]) >= self.filas_por_segmento:
+            self.segmentos.append(_SegmentoBitacora(self.conservar_llamadas))
+        self.segmentos[-1].anexar(llamada.id, id_bytes, llamada.prioridad, epoch_despacho, llamada.epoch,
+                                  llamada.tiempo_estimado_respuesta, categoria, ubicacion, llamada)
+        self.filas_retenidas += 1
+
+        self._aplicar_retencion()
+
+    def _aplicar_retencion(self):
+        while len(self.segmentos) > 1:
+            antiguo = self.segmentos[0]
+            sobra_por_filas = (self.retencion_filas is not None
+                               and self.filas_retenidas - len(antiguo) >= self.retencion_filas)
+            sobra_por_tiempo = (self.retencion_segundos is not None
+                                and self.segmentos[-1].epochs_despacho[-1] - antiguo.epochs_despacho[-1]
+                                > self.retencion_segundos * 1_000_000)
+            if not (sobra_por_filas or sobra_por_tiempo):
+                break
+            self._derramar(self.segmentos.popleft())
+
+    def _derramar(self, segmento: _SegmentoBitacora):
+        if self.archivo_derrame:
+            with open(self.archivo_derrame, 'a', encoding='utf-8') as archivo:
+                archivo.write(''.join(json.dumps(entrada, separators=(',', ':'), ensure_ascii=False) + '\n'
+                                      for entrada in self._entradas_segmento(segmento)))
+        self.filas_retenidas -= len(segmento)
+        self.filas_derramadas += len(segmento)
+
+    def _entradas_segmento(self, segmento: _SegmentoBitacora) -> Iterator[Dict[str, Any]]:
+        for i in range(len(segmento)):
+            yield {
+                'id': segmento.id_en(i),
+                'prioridad': segmento.prioridades[i],
+                'hora_despacho': (_EPOCH_UTC + timedelta(microseconds=segmento.epochs_despacho[i])).astimezone().isoformat(),
+                'categoria': self._categorias[segmento.categorias[i]],
+                'ubicacion': self._ubicaciones[segmento.ubicaciones[i]]
+            }
+
+    def iterar_registro(self, incluir_derrame: bool = False) -> Iterator[Dict[str, Any]]:
+        """Entradas de registro en orden de despacho, reconstruidas desde las columnas"""
+        if incluir_derrame and self.archivo_derrame and os.path.exists(self.archivo_derrame):
+            with open(self.archivo_derrame, 'r', encoding='utf-8') as archivo:
+                for linea in archivo:
+                    yield json.loads(linea)
+        for segmento in self.segmentos:
+            yield from self._entradas_segmento(segmento)
+
+    def columnas(self) -> Dict[str, Any]:
+        """Columnas retenidas concatenadas (arrays del módulo array, o listas si algún valor no cabía)
+        y tablas de códigos internados"""
+        columnas = {
+            'prioridades': array('q'),
+            'epochs_despacho': array('q'),
+            'epochs_llamada': array('q'),
+            'tiempos_respuesta': array('d'),
+            'categorias': array('I'),
+            'ubicaciones': array('I')
+        }
+        for segmento in self.segmentos:
+            for nombre, columna in columnas.items():
+                valores = getattr(segmento, nombre)
+                if isinstance(valores, list) and isinstance(columna, array):
+                    columna = columnas[nombre] = list(columna)
+                columna.extend(valores)
+        columnas['nombres_categoria'] = list(self._categorias)
+        columnas['nombres_ubicacion'] = list(self._ubicaciones)
+        return columnas
+
+    def llamadas(self) -> List[LlamadaEmergencia]:
+        """Llamadas retenidas en orden de despacho"""
+        if not self.conservar_llamadas:
+            raise ValueError("La bitácora no conserva las llamadas despachadas")
+        llamadas = []
+        for segmento in self.segmentos:
+            llamadas.extend(segmento.llamadas)
+        return llamadas
+
+    def vaciar(self):
+        self.segmentos.clear()
+        self.filas_retenidas = 0
+        self.filas_derramadas = 0
+
+
+class ReporteSerializado(list):
+    """Filas de reporte ya convertidas a JSON para un modo de guardar_reporte_json, que las escribe tal cual"""
+
+    def __init__(self, modo: str, filas: Iterable[str] = ()):
+        super().__init__(filas)
+        self.modo = modo
+
+
+class SistemaDespachoEmergencias:
+    def __init__(self, particionar_por_zona: bool = False, cubetas: Optional[int] = None,
+                 retencion_filas: Optional[int] = None, retencion_segundos: Optional[float] = None,
+                 archivo_derrame: Optional[str] = None, conservar_llamadas: bool = True):
+        if particionar_por_zona or cubetas:
+            self.cola_prioridad = ColaPrioridadParticionada(cubetas)
+        else:
+            self.cola_prioridad = ColaPrioridadIndexada()
+        # Con conservar_llamadas=False la bitácora solo guarda columnas y no se pueden generar reportes
+        self.bitacora = BitacoraDespachos(retencion_filas, retencion_segundos, archivo_derrame,
+                                          conservar_llamadas=conservar_llamadas)
+        self.diario: Optional[DiarioDespacho] = None
+        # Despachadas desde el último snapshot, que el siguiente snapshot anexa al historial del diario
+        self._historial_pendiente: Optional[List[LlamadaEmergencia]] = None
+        self.instrumentacion: Optional[Instrumentacion] = None
+
+    @property
+    def llamadas_despachadas(self) -> List[LlamadaEmergencia]:
+        """Llamadas despachadas retenidas por la bitácora (lista nueva en cada acceso)"""
+        return self.bitacora.llamadas()
+
+    @llamadas_despachadas.setter
+    def llamadas_despachadas(self, llamadas: List[LlamadaEmergencia]):
+        self.bitacora.vaciar()
+        for llamada in llamadas:
+            self.bitacora.agregar(llamada)
+
+    @property
+    def registro(self) -> List[Dict[str, Any]]:
+        return list(self.bitacora.iterar_registro())
+
+    def habilitar_instrumentacion(self, sumidero: Optional[Any] = None) -> Instrumentacion:
+        self.instrumentacion = Instrumentacion(sumidero)
+        return self.instrumentacion
+
+    def _medir(self, operacion: str, inicio_ns: int):
+        if self.instrumentacion is not None:
+            self.instrumentacion.registrar(operacion, time.perf_counter_ns() - inicio_ns)
+
+    def habilitar_diario(self, directorio: str, **opciones):
+        """Activa el journal en el directorio indicado, recuperando antes el último snapshot y los eventos posteriores"""
+        diario = DiarioDespacho(directorio, **opciones)
+        snapshot, eventos = diario.recuperar()
+
+        if snapshot is not None:
+            self.cola_prioridad.extender([LlamadaEmergencia(datos) for datos in snapshot['cola']])
+            # Solo se lee la parte del historial que la bitácora retenía; lo anterior (y lo que la retención
+            # descarte aquí) ya se había volcado antes de la caída
+            archivo_derrame, self.bitacora.archivo_derrame = self.bitacora.archivo_derrame, None
+            try:
+                for datos, hora_despacho in diario.iterar_historial():
+                    self._registrar_despacho(LlamadaEmergencia(datos), datetime.fromisoformat(hora_despacho),
+                                             silencioso=True)
+            finally:
+                self.bitacora.archivo_derrame = archivo_derrame
+            self.bitacora.filas_derramadas += diario.primera_linea_retenida
+
+        self._historial_pendiente = []
+
+        for evento in eventos:
+            operacion = evento['op']
+            if operacion == 'encolar':
+                # Una carga masiva puede tomar un snapshot a mitad de lote: reproducir es idempotente
+                if evento['datos']['id'] not in self.cola_prioridad:
+                    self.cola_prioridad.agregar(LlamadaEmergencia(evento['datos']))
+            elif operacion == 'despachar':
+                llamada = self.cola_prioridad.eliminar(evento['id'])
+                if llamada is not None:
+                    self._registrar_despacho(llamada, datetime.fromisoformat(evento['hora']), silencioso=True)
+            elif operacion == 'reprioritizar':
+                self.cola_prioridad.actualizar_prioridad(evento['id'], evento['prioridad'])
+            elif operacion == 'cancelar':
+                self.cola_prioridad.eliminar(evento['id'])
+
+        self.diario = diario
+        print(f"Diario recuperado: {len(self.cola_prioridad)} llamadas en cola, "
+              f"{len(self.bitacora)} despachadas, {len(eventos)} eventos reproducidos")
+
+    def guardar_snapshot(self):
+        """Guarda la cola viva, anexa al historial las llamadas despachadas desde el último snapshot y trunca
+        el journal; el costo es proporcional a la cola y al lote nuevo, no a todo lo despachado"""
+        if self.diario is None:
+            raise ValueError("El diario no está habilitado")
+        retencion_activa = self.bitacora.retencion_filas is not None or self.bitacora.retencion_segundos is not None
+        self.diario.guardar_snapshot(
+            {'cola': [llamada.a_diccionario() for llamada in self.cola_prioridad]},
+            [[llamada.a_diccionario(), llamada.tiempo_despacho.isoformat()] for llamada in self._historial_pendiente],
+            len(self.bitacora) if retencion_activa else None
+        )
+        self._historial_pendiente.clear()
+
+    def cerrar_diario(self):
+        if self.diario is not None:
+            self.diario.cerrar()
+            self.diario = None
+            self._historial_pendiente = None
+
+    def _anotar(self, operacion: str, **datos):
+        """Registra un evento en el diario (si está habilitado) y toma un snapshot periódico"""
+        if self.diario is None:
+            return
+        self.diario.registrar(operacion, **datos)
+        if self.diario.eventos_desde_snapshot >= self.diario.eventos_por_snapshot:
+            self.guardar_snapshot()
 
     def cargar_llamadas_desde_json(self, nombre_archivo: str):
         """Carga llamadas de emergencia desde archivo JSON"""
@@ -57,8 +1106,7 @@ class SistemaDespachoEmergencias:
                 datos = json.load(archivo)
 
             for datos_llamada in datos.get('llamadas', []):
-                llamada = LlamadaEmergencia(datos_llamada)
-                heapq.heappush(self.cola_prioridad, llamada)
+                self.encolar_llamada(LlamadaEmergencia(datos_llamada))
 
             print(f"Cargadas {len(self.cola_prioridad)} llamadas de emergencia")
 
@@ -71,27 +1119,172 @@ class SistemaDespachoEmergencias:
         except Exception as e:
             print(f"Error inesperado cargando llamadas: {e}")
 
-    def despachar_siguiente_emergencia(self) -> Optional[LlamadaEmergencia]:
-        """Despacha la llamada de emergencia de mayor prioridad"""
-        if not self.cola_prioridad:
-            return None
+    def cargar_llamadas_streaming(self, nombre_archivo: str, formato: Optional[str] = None,
+                                  tamano_bloque: int = 1 << 16) -> Tuple[int, int]:
+        """Carga llamadas en streaming desde JSONL o desde un arreglo {"llamadas": [...]} y construye el heap con un solo heapify"""
+        if formato is None:
+            formato = 'jsonl' if nombre_archivo.endswith(('.jsonl', '.ndjson')) else 'json'
+        if formato not in ('json', 'jsonl'):
+            raise ValueError("Formato de llamadas no soportado")
+
+        nuevas = []
+        ids_nuevos = set()
+        invalidas = 0
+        try:
+            with open(nombre_archivo, 'r', encoding='utf-8') as archivo:
+                if formato == 'jsonl':
+                    registros = self._iterar_llamadas_jsonl(archivo)
+                else:
+                    registros = self._iterar_llamadas_arreglo(archivo, tamano_bloque)
+
+                for linea, datos_llamada in registros:
+                    try:
+                        if isinstance(datos_llamada, Exception):
+                            raise datos_llamada
+                        llamada = LlamadaEmergencia(datos_llamada)
+                        if llamada.id in ids_nuevos or llamada.id in self.cola_prioridad:
+                            raise ValueError(f"id duplicado {llamada.id}")
+                        ids_nuevos.add(llamada.id)
+                        nuevas.append(llamada)
+                    except KeyError as e:
+                        invalidas += 1
+                        logger.warning("Error: Campo requerido %s faltante en línea %d de %s", e, linea, nombre_archivo)
+                    except (TypeError, ValueError, AttributeError) as e:
+                        invalidas += 1
+                        logger.warning("Error: Registro inválido en línea %d de %s: %s", linea, nombre_archivo, e)
 
-        llamada = heapq.heappop(self.cola_prioridad)
-        llamada.tiempo_despacho = datetime.now()
-        self.llamadas_despachadas.append(llamada)
+        except FileNotFoundError:
+            print(f"Error: Archivo {nombre_archivo} no encontrado")
+        except ValueError as e:
+            print(f"Error: Formato JSON inválido en {nombre_archivo}: {e}")
+
+        # Se conservan las llamadas válidas leídas aunque la carga se haya interrumpido
+        inicio = time.perf_counter_ns()
+        self.cola_prioridad.extender(nuevas)
+        self._medir('heapify', inicio)
+        if self.diario is not None:
+            for llamada in nuevas:
+                self._anotar('encolar', datos=llamada.a_diccionario())
+
+        print(f"Cargadas {len(nuevas)} llamadas de emergencia ({invalidas} registros inválidos)")
+        return len(nuevas), invalidas
+
+    @staticmethod
+    def _iterar_llamadas_jsonl(archivo: TextIO) -> Iterator[Tuple[int, Any]]:
+        """Genera (línea, datos) por cada llamada; las líneas mal formadas se entregan como excepción"""
+        for numero_linea, linea in enumerate(archivo, 1):
+            if not linea.strip():
+                continue
+            try:
+                yield numero_linea, json.loads(linea)
+            except json.JSONDecodeError as e:
+                yield numero_linea, ValueError(f"JSON inválido: {e.msg}")
+
+    @staticmethod
+    def _iterar_llamadas_arreglo(archivo: TextIO, tamano_bloque: int) -> Iterator[Tuple[int, Any]]:
+        """Genera (línea, datos) por cada elemento de "llamadas" decodificando el documento de forma incremental"""
+        lector = _LectorJSONIncremental(archivo, tamano_bloque)
+        lector.consumir('{')
+        if lector.siguiente_caracter() == '}':
+            return
+
+        while True:
+            clave = lector.decodificar()
+            lector.consumir(':')
+            if clave == 'llamadas':
+                lector.consumir('[')
+                if lector.siguiente_caracter() == ']':
+                    lector.consumir(']')
+                else:
+                    while True:
+                        lector.siguiente_caracter()
+                        linea = lector.linea
+                        yield linea, lector.decodificar()
+                        if lector.siguiente_caracter() != ',':
+                            lector.consumir(']')
+                            break
+                        lector.consumir(',')
+            else:
+                lector.decodificar()
+
+            if lector.siguiente_caracter() != ',':
+                lector.consumir('}')
+                return
+            lector.consumir(',')
+
+    def encolar_llamada(self, llamada: LlamadaEmergencia):
+        """Agrega una llamada a la cola de prioridad en O(log n)"""
+        instrumentacion = self.instrumentacion
+        if instrumentacion is None:
+            self.cola_prioridad.agregar(llamada)
+        else:
+            inicio = time.perf_counter_ns()
+            self.cola_prioridad.agregar(llamada)
+            instrumentacion.registrar('heap_push', time.perf_counter_ns() - inicio)
+            instrumentacion.incrementar('llamadas_encoladas')
+        self._anotar('encolar', datos=llamada.a_diccionario())
+
+    def reprioritizar(self, id_llamada: str, prioridad: int) -> bool:
+        """Cambia la prioridad de una llamada aún no despachada en O(log n)"""
+        if not self.cola_prioridad.actualizar_prioridad(id_llamada, prioridad):
+            logger.warning("Advertencia: Llamada %s no está en cola", id_llamada)
+            return False
+        self._anotar('reprioritizar', id=id_llamada, prioridad=prioridad)
+        logger.info("Repriorizada: %s (Prioridad: %s)", id_llamada, prioridad)
+        return True
+
+    def cancelar(self, id_llamada: str) -> Optional[LlamadaEmergencia]:
+        """Retira de la cola una llamada aún no despachada en O(log n)"""
+        llamada = self.cola_prioridad.eliminar(id_llamada)
+        if llamada is None:
+            logger.warning("Advertencia: Llamada %s no está en cola", id_llamada)
+            return None
+        self._anotar('cancelar', id=id_llamada)
+        logger.info("Cancelada: %s (Prioridad: %s, Categoría: %s)", id_llamada, llamada.prioridad, llamada.categoria)
+        return llamada
 
-        entrada_registro = {
-            'id': llamada.id,
-            'prioridad': llamada.prioridad,
-            'hora_despacho': llamada.tiempo_despacho.isoformat(),
-            'categoria': llamada.categoria,
-            'ubicacion': llamada.ubicacion
-        }
-        self.registro.append(entrada_registro)
+    def despachar_siguiente_emergencia(self, zona: Any = None) -> Optional[LlamadaEmergencia]:
+        """Despacha la llamada de emergencia de mayor prioridad (de una zona si la cola está particionada)"""
+        if zona is not None:
+            if not isinstance(self.cola_prioridad, ColaPrioridadParticionada):
+                raise ValueError("El despacho por zona requiere una cola particionada")
+            if self.cola_prioridad.ver_siguiente(zona) is None:
+                return None
+            llamada = self.cola_prioridad.extraer(zona)
+        else:
+            if not self.cola_prioridad:
+                return None
+            instrumentacion = self.instrumentacion
+            if instrumentacion is None:
+                llamada = self.cola_prioridad.extraer()
+            else:
+                inicio = time.perf_counter_ns()
+                llamada = self.cola_prioridad.extraer()
+                instrumentacion.registrar('heap_pop', time.perf_counter_ns() - inicio)
 
-        print(f"Despachada: {llamada.id} (Prioridad: {llamada.prioridad}, Categoría: {llamada.categoria})")
+        self._registrar_despacho(llamada)
         return llamada
 
+    def _registrar_despacho(self, llamada: LlamadaEmergencia, tiempo_despacho: Optional[datetime] = None,
+                            silencioso: bool = False):
+        # Siempre con zona horaria: los epochs de la bitácora y el retraso de despacho no dependen del desfase
+        # local vigente (p. ej. al cruzar un cambio de horario); las horas sin zona de diarios antiguos son locales
+        if tiempo_despacho is None:
+            tiempo_despacho = datetime.now().astimezone()
+        elif tiempo_despacho.tzinfo is None:
+            tiempo_despacho = tiempo_despacho.astimezone()
+        llamada.tiempo_despacho = tiempo_despacho
+        self.bitacora.agregar(llamada)
+        if self._historial_pendiente is not None:
+            self._historial_pendiente.append(llamada)
+
+        if silencioso:
+            return
+        self._anotar('despachar', id=llamada.id, hora=llamada.tiempo_despacho.isoformat())
+        if self.instrumentacion is not None:
+            self.instrumentacion.incrementar('llamadas_despachadas')
+        logger.info("Despachada: %s (Prioridad: %s, Categoría: %s)", llamada.id, llamada.prioridad, llamada.categoria)
+
     def procesar_todas_llamadas(self):
         """Procesa todas las llamadas en la cola de prioridad"""
         print("Iniciando procesamiento de despacho de emergencias...")
@@ -103,63 +1296,241 @@ class SistemaDespachoEmergencias:
             contador_despachos += 1
 
         tiempo_fin = time.time()
+        vaciar_registro()
         print(f"Procesadas {contador_despachos} llamadas de emergencia en {tiempo_fin - tiempo_inicio:.4f} segundos")
 
-    def generar_reporte(self, algoritmo_ordenamiento: str = 'quicksort'):
-        """Genera reporte final con algoritmo de ordenamiento especificado"""
-        if not self.llamadas_despachadas:
+    def generar_reporte(self, algoritmo_ordenamiento: str = 'quicksort', procesos: Optional[int] = None,
+                        limite: Optional[int] = None, desplazamiento: int = 0,
+                        modo_serializado: str = 'indentado'):
+        """Genera reporte final con algoritmo de ordenamiento especificado.
+        Con limite se devuelve solo la página [desplazamiento, desplazamiento + limite) usando selección
+        con heap acotado en O(n log k) en lugar del ordenamiento completo.
+        Con 'paralelo' los procesos construyen y devuelven las filas ya convertidas a JSON para el modo
+        modo_serializado de guardar_reporte_json, y se obtiene un ReporteSerializado en lugar de diccionarios"""
+        if (limite is not None and limite < 0) or desplazamiento < 0:
+            raise ValueError("limite y desplazamiento deben ser no negativos")
+
+        if not self.bitacora:
             print("No se han despachado llamadas aún")
             return [], 0
 
-        llamadas_a_ordenar = self.llamadas_despachadas.copy()
+        if limite is not None:
+            tiempo_inicio = time.time()
+            inicio = time.perf_counter_ns()
+            seleccionadas = heapq.nsmallest(desplazamiento + limite, self.llamadas_despachadas,
+                                            key=self._clave_ordenamiento_llamada)[desplazamiento:]
+            self._medir('seleccion_top_k', inicio)
+            tiempo_ordenamiento = time.time() - tiempo_inicio
+            reporte = self._construir_reporte(seleccionadas)
+            print(f"Reporte generado con {len(reporte)} llamadas (top {desplazamiento + limite}) en {tiempo_ordenamiento:.6f} segundos")
+            return reporte, tiempo_ordenamiento
+
+        if algoritmo_ordenamiento == 'paralelo':
+            tiempo_inicio = time.time()
+            inicio = time.perf_counter_ns()
+            reporte = self._generar_reporte_paralelo(self.llamadas_despachadas, procesos or os.cpu_count() or 1,
+                                                     desplazamiento, modo_serializado)
+            self._medir('reporte_paralelo', inicio)
+            tiempo_ordenamiento = time.time() - tiempo_inicio
+            print(f"Reporte generado con {len(reporte)} llamadas ordenadas por {algoritmo_ordenamiento} en {tiempo_ordenamiento:.6f} segundos")
+            return reporte, tiempo_ordenamiento
+
+        llamadas_a_ordenar = self.llamadas_despachadas
 
         tiempo_inicio = time.time()
+        inicio = time.perf_counter_ns()
+
+        llamadas_ordenadas = self._ordenar_llamadas(llamadas_a_ordenar, algoritmo_ordenamiento)
+
+        self._medir(f'ordenamiento_{algoritmo_ordenamiento}', inicio)
+        tiempo_fin = time.time()
+        tiempo_ordenamiento = tiempo_fin - tiempo_inicio
 
+        reporte = self._construir_reporte(llamadas_ordenadas[desplazamiento:])
+
+        print(f"Reporte generado con {len(reporte)} llamadas ordenadas por {algoritmo_ordenamiento} en {tiempo_ordenamiento:.6f} segundos")
+        return reporte, tiempo_ordenamiento
+
+    def _construir_reporte(self, llamadas: List[LlamadaEmergencia]) -> List[Dict[str, Any]]:
+        instrumentacion = self.instrumentacion
+        if instrumentacion is None:
+            return [self._construir_fila_reporte(llamada) for llamada in llamadas]
+
+        # Con instrumentación se aplana primero cada llamada para separar su costo del de construir filas
+        for llamada in llamadas:
+            inicio = time.perf_counter_ns()
+            llamada.resumen_subtareas()
+            instrumentacion.registrar('aplanar_subtareas', time.perf_counter_ns() - inicio)
+        with instrumentacion.medir('construccion_reporte'):
+            reporte = [self._construir_fila_reporte(llamada) for llamada in llamadas]
+        instrumentacion.incrementar('filas_reporte', len(reporte))
+        return reporte
+
+    def iterar_reporte(self, algoritmo_ordenamiento: str = 'timsort', limite: Optional[int] = None,
+                       desplazamiento: int = 0) -> Iterator[Dict[str, Any]]:
+        """Genera las filas del reporte una a una, sin materializar la lista completa de filas"""
+        if limite is not None:
+            llamadas_ordenadas = heapq.nsmallest(desplazamiento + limite, self.llamadas_despachadas,
+                                                 key=self._clave_ordenamiento_llamada)
+        else:
+            llamadas_ordenadas = self._ordenar_llamadas(self.llamadas_despachadas, algoritmo_ordenamiento)
+        for indice in range(desplazamiento, len(llamadas_ordenadas)):
+            yield self._construir_fila_reporte(llamadas_ordenadas[indice])
+
+    def _ordenar_llamadas(self, llamadas: List[LlamadaEmergencia], algoritmo_ordenamiento: str) -> List[LlamadaEmergencia]:
+        """Ordena las llamadas para el reporte con el algoritmo indicado"""
         if algoritmo_ordenamiento == 'quicksort':
             limite_recursion_original = sys.getrecursionlimit()
-            if len(llamadas_a_ordenar) > 1000:
+            if len(llamadas) > 1000:
                 sys.setrecursionlimit(10000)
 
-            llamadas_ordenadas = self.quicksort_iterativo(llamadas_a_ordenar)
+            llamadas_ordenadas = self.quicksort_iterativo(llamadas)
 
-            if len(llamadas_a_ordenar) > 1000:
+            if len(llamadas) > 1000:
                 sys.setrecursionlimit(limite_recursion_original)
 
         elif algoritmo_ordenamiento == 'mergesort':
-            llamadas_ordenadas = self.mergesort(llamadas_a_ordenar)
+            llamadas_ordenadas = self.mergesort(llamadas)
         elif algoritmo_ordenamiento == 'timsort':
-            llamadas_ordenadas = sorted(llamadas_a_ordenar, key=self._clave_ordenamiento_llamada)
+            llamadas_ordenadas = sorted(llamadas, key=self._clave_ordenamiento_llamada)
+        elif algoritmo_ordenamiento == 'radix':
+            llamadas_ordenadas = self.radix_sort(llamadas)
+        elif algoritmo_ordenamiento == 'introsort':
+            llamadas_ordenadas = self.introsort(llamadas)
+        elif algoritmo_ordenamiento == 'numpy':
+            llamadas_ordenadas = self.ordenar_numpy(llamadas)
         else:
             raise ValueError("Algoritmo de ordenamiento no soportado")
 
-        tiempo_fin = time.time()
-        tiempo_ordenamiento = tiempo_fin - tiempo_inicio
+        return llamadas_ordenadas
+
+    def ordenar_numpy(self, llamadas: List[LlamadaEmergencia]) -> List[LlamadaEmergencia]:
+        """Ordena con un único np.lexsort sobre (id, timestamp, prioridad, tiempo_estimado_respuesta);
+        sin NumPy recurre a timsort con la misma clave"""
+        if np is None:
+            return sorted(llamadas, key=self._clave_ordenamiento_llamada)
+
+        datos = np.empty(len(llamadas), dtype=[('tiempo', 'f8'), ('prioridad', 'i8'), ('timestamp', 'i8')])
+        datos['tiempo'] = np.fromiter((llamada.tiempo_estimado_respuesta for llamada in llamadas),
+                                      dtype=np.float64, count=len(llamadas))
+        datos['prioridad'] = np.fromiter((llamada.prioridad for llamada in llamadas), dtype=np.int64, count=len(llamadas))
+        datos['timestamp'] = np.fromiter((llamada.epoch for llamada in llamadas), dtype=np.int64, count=len(llamadas))
+        ids = np.array([llamada.id for llamada in llamadas])
+        orden = np.lexsort((ids, datos['timestamp'], datos['prioridad'], datos['tiempo']))
+        return [llamadas[i] for i in orden.tolist()]
+
+    def estadisticas_despacho(self, percentiles: Tuple[float, ...] = (50, 90, 99)) -> Dict[str, Any]:
+        """Resumen de las llamadas retenidas en la bitácora: conteos por categoría y ubicación, percentiles
+        de tiempo_estimado_respuesta y del retraso de despacho (tiempo_despacho - timestamp, en segundos).
+        Vectorizado con NumPy sobre las columnas de la bitácora, con respaldo en Python puro"""
+        columnas = self.bitacora.columnas()
+
+        if np is not None:
+            datos = np.empty(len(columnas['prioridades']), dtype=[
+                ('tiempo', 'f8'), ('despacho', 'i8'), ('timestamp', 'i8'), ('categoria', 'u4'), ('ubicacion', 'u4')])
+            datos['tiempo'] = np.asarray(columnas['tiempos_respuesta'], dtype=np.float64)
+            datos['despacho'] = np.frombuffer(columnas['epochs_despacho'], dtype=np.int64)
+            datos['timestamp'] = np.frombuffer(columnas['epochs_llamada'], dtype=np.int64)
+            datos['categoria'] = np.frombuffer(columnas['categorias'], dtype=np.uint32)
+            datos['ubicacion'] = np.frombuffer(columnas['ubicaciones'], dtype=np.uint32)
+
+            por_categoria = np.bincount(datos['categoria'], minlength=len(columnas['nombres_categoria'])).tolist()
+            por_ubicacion = np.bincount(datos['ubicacion'], minlength=len(columnas['nombres_ubicacion'])).tolist()
+            retrasos = (datos['despacho'] - datos['timestamp']) / 1e6
+            if len(datos):
+                percentiles_tiempo = np.percentile(datos['tiempo'], percentiles).tolist()
+                percentiles_retraso = np.percentile(retrasos, percentiles).tolist()
+            else:
+                percentiles_tiempo = percentiles_retraso = [0.0] * len(percentiles)
+        else:
+            por_categoria = [0] * len(columnas['nombres_categoria'])
+            for codigo in columnas['categorias']:
+                por_categoria[codigo] += 1
+            por_ubicacion = [0] * len(columnas['nombres_ubicacion'])
+            for codigo in columnas['ubicaciones']:
+                por_ubicacion[codigo] += 1
+            tiempos = sorted(columnas['tiempos_respuesta'])
+            retrasos = sorted((despacho - llamada) / 1e6 for despacho, llamada
+                              in zip(columnas['epochs_despacho'], columnas['epochs_llamada']))
+            percentiles_tiempo = [_percentil_lineal(tiempos, p) for p in percentiles]
+            percentiles_retraso = [_percentil_lineal(retrasos, p) for p in percentiles]
+
+        return {
+            'total_llamadas': len(columnas['prioridades']),
+            'llamadas_por_categoria': {nombre: conteo for nombre, conteo
+                                       in zip(columnas['nombres_categoria'], por_categoria) if conteo},
+            'llamadas_por_ubicacion': {nombre: conteo for nombre, conteo
+                                       in zip(columnas['nombres_ubicacion'], por_ubicacion) if conteo},
+            'tiempo_estimado_respuesta': {f'p{p:g}': valor for p, valor in zip(percentiles, percentiles_tiempo)},
+            'retraso_despacho_segundos': {f'p{p:g}': valor for p, valor in zip(percentiles, percentiles_retraso)}
+        }
 
-        reporte = []
-        for llamada in llamadas_ordenadas:
-            subtareas_aplanadas = llamada.aplanar_subtareas()
-            reporte.append({
-                'id': llamada.id,
-                'prioridad': llamada.prioridad,
-                'timestamp': llamada.timestamp.isoformat(),
-                'tiempo_estimado_respuesta': llamada.tiempo_estimado_respuesta,
-                'categoria': llamada.categoria,
-                'ubicacion': llamada.ubicacion,
-                'descripcion': llamada.descripcion,
-                'subtareas_aplanadas': subtareas_aplanadas,
-                'total_subtareas': len(subtareas_aplanadas),
-                'hora_despacho': llamada.tiempo_despacho.isoformat() if llamada.tiempo_despacho else None
-            })
+    def _generar_reporte_paralelo(self, llamadas: List[LlamadaEmergencia], procesos: int, desplazamiento: int = 0,
+                                  modo_serializado: str = 'indentado') -> 'ReporteSerializado':
+        """Reparte las llamadas en bloques entre procesos: cada uno ordena su bloque, construye sus filas y las
+        devuelve ya serializadas junto con sus índices globales, y aquí se fusionan con un k-way merge estable,
+        idéntico al reporte serial con timsort. El proceso padre no construye ni deserializa diccionarios"""
+        if modo_serializado not in _MODOS_REPORTE:
+            raise ValueError("Modo de reporte no soportado")
 
-        print(f"Reporte generado con {len(reporte)} llamadas ordenadas por {algoritmo_ordenamiento} en {tiempo_ordenamiento:.6f} segundos")
-        return reporte, tiempo_ordenamiento
+        if procesos <= 1 or len(llamadas) < _MINIMO_LLAMADAS_PARALELO:
+            bloques_ordenados = [_ordenar_bloque_reporte(llamadas, 0, modo_serializado)]
+        else:
+            global _LLAMADAS_COMPARTIDAS
+            tamano_bloque = -(-len(llamadas) // procesos)
+            rangos = [(i, min(i + tamano_bloque, len(llamadas))) for i in range(0, len(llamadas), tamano_bloque)]
+
+            if 'fork' in multiprocessing.get_all_start_methods():
+                _LLAMADAS_COMPARTIDAS = llamadas
+                # Los objetos heredados pasan a la generación permanente: el gc de los hijos no los recorre
+                # y no fuerza la copia de sus páginas compartidas por copy-on-write
+                gc.freeze()
+                try:
+                    with ProcessPoolExecutor(max_workers=len(rangos),
+                                             mp_context=multiprocessing.get_context('fork')) as ejecutor:
+                        bloques_ordenados = list(ejecutor.map(_ordenar_rango_compartido, rangos,
+                                                              [modo_serializado] * len(rangos)))
+                finally:
+                    gc.unfreeze()
+                    _LLAMADAS_COMPARTIDAS = []
+            else:
+                with ProcessPoolExecutor(max_workers=len(rangos)) as ejecutor:
+                    bloques_ordenados = list(ejecutor.map(_ordenar_bloque_reporte,
+                                                          [llamadas[inicio:fin] for inicio, fin in rangos],
+                                                          [inicio for inicio, _ in rangos],
+                                                          [modo_serializado] * len(rangos)))
+
+        if len(bloques_ordenados) == 1:
+            return ReporteSerializado(modo_serializado, bloques_ordenados[0][1][desplazamiento:])
+
+        clave = self._clave_ordenamiento_llamada
+        pares = heapq.merge(*(zip(indices, filas) for indices, filas in bloques_ordenados),
+                            key=lambda par: clave(llamadas[par[0]]))
+        return ReporteSerializado(modo_serializado, (fila for _, fila in islice(pares, desplazamiento, None)))
+
+    @staticmethod
+    def _construir_fila_reporte(llamada: LlamadaEmergencia) -> Dict[str, Any]:
+        subtareas_aplanadas = llamada.aplanar_subtareas()
+        return {
+            'id': llamada.id,
+            'prioridad': llamada.prioridad,
+            'timestamp': llamada.timestamp.isoformat(),
+            'tiempo_estimado_respuesta': llamada.tiempo_estimado_respuesta,
+            'categoria': llamada.categoria,
+            'ubicacion': llamada.ubicacion,
+            'descripcion': llamada.descripcion,
+            'subtareas_aplanadas': subtareas_aplanadas,
+            'total_subtareas': len(subtareas_aplanadas),
+            'hora_despacho': llamada.tiempo_despacho.isoformat() if llamada.tiempo_despacho else None
+        }
 
-    def _clave_ordenamiento_llamada(self, llamada: LlamadaEmergencia) -> tuple:
+    @staticmethod
+    def _clave_ordenamiento_llamada(llamada: LlamadaEmergencia) -> tuple:
         """Función clave para ordenar llamadas"""
         return (
             llamada.tiempo_estimado_respuesta,
             llamada.prioridad,
-            llamada.timestamp,
+            llamada.epoch,
             llamada.id
         )
 
@@ -233,20 +1604,223 @@ class SistemaDespachoEmergencias:
         if llamada1.prioridad != llamada2.prioridad:
             return llamada1.prioridad - llamada2.prioridad
 
-        if llamada1.timestamp != llamada2.timestamp:
-            return -1 if llamada1.timestamp < llamada2.timestamp else 1
+        if llamada1.epoch != llamada2.epoch:
+            return -1 if llamada1.epoch < llamada2.epoch else 1
 
         return -1 if llamada1.id < llamada2.id else 1
 
-    def guardar_reporte_json(self, reporte: List[Dict[str, Any]], nombre_archivo: str):
-        """Guarda el reporte en un archivo JSON"""
+    def radix_sort(self, arr: List[LlamadaEmergencia]) -> List[LlamadaEmergencia]:
+        """Radix sort LSD con pasadas de conteo estables sobre prioridad y tiempo_estimado_respuesta
+        (enteros acotados); los empates restantes se ordenan por (timestamp, id) dentro de cada grupo"""
+        if len(arr) <= 1:
+            return list(arr)
+
+        tiempos = [llamada.tiempo_estimado_respuesta for llamada in arr]
+        prioridades = [llamada.prioridad for llamada in arr]
+        if not all(type(valor) is int for valor in tiempos) or not all(type(valor) is int for valor in prioridades):
+            return self.introsort(arr)
+
+        minimo_tiempo, maximo_tiempo = min(tiempos), max(tiempos)
+        minimo_prioridad, maximo_prioridad = min(prioridades), max(prioridades)
+        limite_rango = 4 * len(arr) + 1024
+        if maximo_tiempo - minimo_tiempo >= limite_rango or maximo_prioridad - minimo_prioridad >= limite_rango:
+            return self.introsort(arr)
+
+        # LSD: primero el dígito menos significativo (prioridad), luego tiempo_estimado_respuesta
+        ordenadas = self._pasada_conteo(arr, prioridades, minimo_prioridad, maximo_prioridad - minimo_prioridad + 1)
+        ordenadas = self._pasada_conteo(ordenadas, [llamada.tiempo_estimado_respuesta for llamada in ordenadas],
+                                        minimo_tiempo, maximo_tiempo - minimo_tiempo + 1)
+
+        inicio = 0
+        for i in range(1, len(ordenadas) + 1):
+            if (i == len(ordenadas)
+                    or ordenadas[i].tiempo_estimado_respuesta != ordenadas[inicio].tiempo_estimado_respuesta
+                    or ordenadas[i].prioridad != ordenadas[inicio].prioridad):
+                if i - inicio > 1:
+                    ordenadas[inicio:i] = sorted(ordenadas[inicio:i], key=lambda llamada: (llamada.epoch, llamada.id))
+                inicio = i
+
+        return ordenadas
+
+    @staticmethod
+    def _pasada_conteo(arr: List[LlamadaEmergencia], digitos: List[int], minimo: int, rango: int) -> List[LlamadaEmergencia]:
+        """Pasada estable de counting sort según el dígito entero de cada elemento"""
+        posiciones = [0] * (rango + 1)
+        for digito in digitos:
+            posiciones[digito - minimo + 1] += 1
+        for i in range(1, rango + 1):
+            posiciones[i] += posiciones[i - 1]
+
+        salida = [None] * len(arr)
+        for elemento, digito in zip(arr, digitos):
+            indice = digito - minimo
+            salida[posiciones[indice]] = elemento
+            posiciones[indice] += 1
+        return salida
+
+    def introsort(self, arr: List[LlamadaEmergencia]) -> List[LlamadaEmergencia]:
+        """Introsort iterativo: QuickSort con mediana de tres y partición de tres vías,
+        HeapSort al superar 2·log2(n) niveles e inserción para rangos pequeños"""
+        decoradas = [(self._clave_ordenamiento_llamada(llamada), llamada) for llamada in arr]
+        if len(decoradas) > 1:
+            pila = [(0, len(decoradas) - 1, 2 * int(math.log2(len(decoradas))))]
+            while pila:
+                bajo, alto, profundidad = pila.pop()
+                while alto - bajo >= _UMBRAL_INSERCION:
+                    if profundidad == 0:
+                        self._heapsort_rango(decoradas, bajo, alto)
+                        bajo = alto
+                        break
+                    profundidad -= 1
+                    pivote = self._mediana_de_tres(decoradas, bajo, (bajo + alto) // 2, alto)
+                    menor, mayor = self._particion_tres_vias(decoradas, bajo, alto, pivote)
+                    # Se apila el lado mayor y se continúa con el menor: pila O(log n)
+                    if menor - bajo < alto - mayor:
+                        pila.append((mayor + 1, alto, profundidad))
+                        alto = menor - 1
+                    else:
+                        pila.append((bajo, menor - 1, profundidad))
+                        bajo = mayor + 1
+                self._insercion_rango(decoradas, bajo, alto)
+
+        return [llamada for _, llamada in decoradas]
+
+    @staticmethod
+    def _mediana_de_tres(arr: List[Tuple[tuple, LlamadaEmergencia]], a: int, b: int, c: int) -> tuple:
+        clave_a, clave_b, clave_c = arr[a][0], arr[b][0], arr[c][0]
+        if clave_a < clave_b:
+            if clave_b < clave_c:
+                return clave_b
+            return clave_c if clave_a < clave_c else clave_a
+        if clave_a < clave_c:
+            return clave_a
+        return clave_c if clave_b < clave_c else clave_b
+
+    @staticmethod
+    def _particion_tres_vias(arr: List[Tuple[tuple, LlamadaEmergencia]], bajo: int, alto: int, pivote: tuple) -> Tuple[int, int]:
+        """Partición de Dijkstra: deja [bajo, menor) < pivote, [menor, mayor] == pivote, (mayor, alto] > pivote"""
+        menor, i, mayor = bajo, bajo, alto
+        while i <= mayor:
+            clave = arr[i][0]
+            if clave < pivote:
+                arr[menor], arr[i] = arr[i], arr[menor]
+                menor += 1
+                i += 1
+            elif pivote < clave:
+                arr[i], arr[mayor] = arr[mayor], arr[i]
+                mayor -= 1
+            else:
+                i += 1
+        return menor, mayor
+
+    @staticmethod
+    def _heapsort_rango(arr: List[Tuple[tuple, LlamadaEmergencia]], bajo: int, alto: int):
+        rango = arr[bajo:alto + 1]
+        heapq.heapify(rango)
+        arr[bajo:alto + 1] = [heapq.heappop(rango) for _ in range(len(rango))]
+
+    @staticmethod
+    def _insercion_rango(arr: List[Tuple[tuple, LlamadaEmergencia]], bajo: int, alto: int):
+        for i in range(bajo + 1, alto + 1):
+            elemento = arr[i]
+            j = i - 1
+            while j >= bajo and elemento[0] < arr[j][0]:
+                arr[j + 1] = arr[j]
+                j -= 1
+            arr[j + 1] = elemento
+
+    def guardar_reporte_json(self, reporte: Iterable[Dict[str, Any]], nombre_archivo: str, modo: str = 'indentado',
+                             comprimir: bool = False, filas_por_bloque: int = 1000):
+        """Guarda el reporte en streaming a partir de una lista o un generador de filas.
+        Modos: 'indentado' (mismo formato que json.dump con indent=2), 'compacto' o 'jsonl' (cabecera en la primera línea).
+        Si el total no se conoce de antemano se reserva un hueco en la cabecera y se parchea al final;
+        con gzip, que no admite seek, el total se escribe al final del documento"""
+        if modo not in _MODOS_REPORTE:
+            raise ValueError("Modo de reporte no soportado")
+        preserializado = isinstance(reporte, ReporteSerializado)
+        if preserializado and _serializacion_modo(reporte.modo) != _serializacion_modo(modo):
+            raise ValueError(f"El reporte está serializado para el modo '{reporte.modo}', no para '{modo}'")
+
+        total = len(reporte) if hasattr(reporte, '__len__') else None
+        parchear_total = total is None and not comprimir
+        total_al_final = total is None and comprimir
+        fecha_generacion = json.dumps(datetime.now().isoformat())
+
+        if parchear_total:
+            total_cabecera = '0'.rjust(_ANCHO_TOTAL_REPORTE)
+        else:
+            total_cabecera = str(total)
+
+        if modo == 'indentado':
+            abrir_filas, separador, cerrar_filas = '[\n    ', ',\n    ', '\n  ]'
+        elif modo == 'compacto':
+            abrir_filas, separador, cerrar_filas = '[', ',', ']'
+        else:
+            abrir_filas, separador, cerrar_filas = '', '\n', '\n'
+
+        if preserializado:
+            def serializar(fila: str) -> str:
+                return fila
+        else:
+            def serializar(fila: Dict[str, Any]) -> str:
+                return _serializar_fila_reporte(fila, modo)
+
+        inicio = time.perf_counter_ns()
         try:
-            with open(nombre_archivo, 'w', encoding='utf-8') as archivo:
-                json.dump({
-                    'total_llamadas': len(reporte),
-                    'fecha_generacion': datetime.now().isoformat(),
-                    'llamadas_atendidas': reporte
-                }, archivo, indent=2, ensure_ascii=False, default=str)
+            if comprimir:
+                archivo = gzip.open(nombre_archivo, 'wt', encoding='utf-8', newline='')
+            else:
+                archivo = open(nombre_archivo, 'w', encoding='utf-8', newline='', buffering=_BUFFER_ESCRITURA)
+
+            with archivo:
+                if modo == 'indentado':
+                    archivo.write('{\n')
+                    if not total_al_final:
+                        archivo.write('  "total_llamadas": ')
+                        posicion_total = archivo.tell() if parchear_total else None
+                        archivo.write(f'{total_cabecera},\n')
+                    archivo.write(f'  "fecha_generacion": {fecha_generacion},\n  "llamadas_atendidas": ')
+                elif modo == 'compacto':
+                    archivo.write('{')
+                    if not total_al_final:
+                        archivo.write('"total_llamadas":')
+                        posicion_total = archivo.tell() if parchear_total else None
+                        archivo.write(f'{total_cabecera},')
+                    archivo.write(f'"fecha_generacion":{fecha_generacion},"llamadas_atendidas":')
+                else:
+                    archivo.write('{')
+                    if not total_al_final:
+                        archivo.write('"total_llamadas":')
+                        posicion_total = archivo.tell() if parchear_total else None
+                        archivo.write(f'{total_cabecera},')
+                    archivo.write(f'"fecha_generacion":{fecha_generacion}}}\n')
+
+                escritas = 0
+                bloque = []
+                for fila in reporte:
+                    bloque.append((abrir_filas if escritas == 0 else separador) + serializar(fila))
+                    escritas += 1
+                    if len(bloque) >= filas_por_bloque:
+                        archivo.write(''.join(bloque))
+                        bloque.clear()
+                archivo.write(''.join(bloque))
+
+                if modo == 'jsonl':
+                    if escritas:
+                        archivo.write(cerrar_filas)
+                    if total_al_final:
+                        archivo.write(f'{{"total_llamadas":{escritas}}}\n')
+                else:
+                    archivo.write(cerrar_filas if escritas else '[]')
+                    if total_al_final:
+                        archivo.write(f',\n  "total_llamadas": {escritas}' if modo == 'indentado' else f',"total_llamadas":{escritas}')
+                    archivo.write('\n}' if modo == 'indentado' else '}')
+
+                if parchear_total:
+                    archivo.seek(posicion_total)
+                    archivo.write(str(escritas).rjust(_ANCHO_TOTAL_REPORTE))
+
+            self._medir('escritura_json', inicio)
             print(f"Reporte guardado en {nombre_archivo}")
         except IOError as e:
             print(f"Error guardando reporte: {e}")
@@ -255,17 +1829,260 @@ class SistemaDespachoEmergencias:
         """Imprime el registro de despachos"""
         print("\nRegistro de Despachos:")
         print("-" * 100)
-        for entrada in self.registro:
+        if self.bitacora.filas_derramadas:
+            destino = f" en {self.bitacora.archivo_derrame}" if self.bitacora.archivo_derrame else ""
+            print(f"({self.bitacora.filas_derramadas} despachos anteriores fuera de retención{destino})")
+        for entrada in self.bitacora.iterar_registro():
             print(f"ID: {entrada['id']:12} | Prioridad: {entrada['prioridad']} | "
                   f"Categoría: {entrada['categoria']:15} | Ubicación: {entrada['ubicacion']:15} | "
                   f"Hora Despacho: {entrada['hora_despacho']}")
 
 
+class ServicioDespachoAsync:
+    """Modo servicio sobre SistemaDespachoEmergencias: productores que reciben llamadas JSONL por socket
+    (TCP o Unix), un único despachador que atiende la llamada de mayor prioridad en cuanto hay una unidad
+    libre, backpressure por capacidad de cola y métricas de latencia llegada→despacho"""
+
+    def __init__(self, sistema: SistemaDespachoEmergencias, unidades: int = 4, capacidad_cola: int = 10000,
+                 segundos_por_minuto_respuesta: float = 0.0, muestras_latencia: int = 100000):
+        self.sistema = sistema
+        self.unidades = unidades
+        self.capacidad_cola = capacidad_cola
+        # Tiempo que una unidad queda ocupada por cada minuto de tiempo_estimado_respuesta (simulación)
+        self.segundos_por_minuto_respuesta = segundos_por_minuto_respuesta
+        self.latencias_ns = deque(maxlen=muestras_latencia)
+        self.metricas = {
+            'recibidas': 0,
+            'despachadas': 0,
+            'invalidas': 0,
+            'esperas_por_capacidad': 0,
+            'profundidad_maxima': 0
+        }
+        self._llegadas: Dict[str, int] = {}
+        self._condicion: Optional[asyncio.Condition] = None
+        self._unidades_libres: Optional[asyncio.Semaphore] = None
+        self._servidor = None
+        self._tarea_despachador = None
+        self._tarea_diario = None
+        self._atenciones = set()
+        self._conexiones = set()
+
+    async def iniciar(self, host: str = '127.0.0.1', puerto: int = 0, ruta_unix: Optional[str] = None):
+        """Arranca el despachador y el servidor de ingesta; devuelve la dirección en escucha"""
+        self._condicion = asyncio.Condition()
+        self._unidades_libres = asyncio.Semaphore(self.unidades)
+        self._tarea_despachador = asyncio.create_task(self._despachador())
+        self._tarea_diario = asyncio.create_task(self._sincronizar_diario())
+        if ruta_unix:
+            self._servidor = await asyncio.start_unix_server(self._atender_conexion, path=ruta_unix)
+        else:
+            self._servidor = await asyncio.start_server(self._atender_conexion, host, puerto)
+        return self._servidor.sockets[0].getsockname()
+
+    async def detener(self):
+        """Deja de aceptar conexiones y cancela el despachador, las conexiones abiertas y las unidades ocupadas;
+        es seguro llamarlo aunque el servicio no se haya iniciado"""
+        if self._servidor is not None:
+            self._servidor.close()
+        tareas = [tarea for tarea in (self._tarea_despachador, self._tarea_diario, *self._conexiones,
+                                      *self._atenciones) if tarea is not None]
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        self._tarea_despachador = None
+        self._tarea_diario = None
+        self._conexiones.clear()
+        self._atenciones.clear()
+        if self.sistema.diario is not None:
+            self.sistema.diario.sincronizar()
+        if self._servidor is not None:
+            await self._servidor.wait_closed()
+            self._servidor = None
+
+    async def encolar(self, llamada: LlamadaEmergencia):
+        """Productor: espera mientras la cola está llena (backpressure) y encola la llamada"""
+        async with self._condicion:
+            if len(self.sistema.cola_prioridad) >= self.capacidad_cola:
+                self.metricas['esperas_por_capacidad'] += 1
+                await self._condicion.wait_for(lambda: len(self.sistema.cola_prioridad) < self.capacidad_cola)
+            self.sistema.encolar_llamada(llamada)
+            self._llegadas[llamada.id] = time.perf_counter_ns()
+            self.metricas['recibidas'] += 1
+            self.metricas['profundidad_maxima'] = max(self.metricas['profundidad_maxima'],
+                                                      len(self.sistema.cola_prioridad))
+            self._condicion.notify_all()
+
+    async def _atender_conexion(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        """Cada conexión envía una llamada JSON por línea y recibe un acuse por línea"""
+        tarea = asyncio.current_task()
+        self._conexiones.add(tarea)
+        try:
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                if not linea.strip():
+                    continue
+                try:
+                    llamada = LlamadaEmergencia(json.loads(linea))
+                    await self.encolar(llamada)
+                    respuesta = {'id': llamada.id, 'estado': 'encolada'}
+                except (KeyError, TypeError, ValueError, AttributeError) as e:
+                    self.metricas['invalidas'] += 1
+                    respuesta = {'estado': 'rechazada', 'error': str(e)}
+                escritor.write(json.dumps(respuesta, ensure_ascii=False).encode('utf-8') + b'\n')
+                await escritor.drain()
+        finally:
+            self._conexiones.discard(tarea)
+            escritor.close()
+
+    async def _despachador(self):
+        while True:
+            await self._unidades_libres.acquire()
+            async with self._condicion:
+                await self._condicion.wait_for(lambda: len(self.sistema.cola_prioridad) > 0)
+                llamada = self.sistema.despachar_siguiente_emergencia()
+                self._condicion.notify_all()
+
+            llegada = self._llegadas.pop(llamada.id, None)
+            if llegada is not None:
+                self.latencias_ns.append(time.perf_counter_ns() - llegada)
+            self.metricas['despachadas'] += 1
+
+            tarea = asyncio.create_task(self._ocupar_unidad(llamada))
+            self._atenciones.add(tarea)
+            tarea.add_done_callback(self._atenciones.discard)
+
+    async def _sincronizar_diario(self):
+        """Hace cumplir el límite de tiempo del fsync por lotes aunque tras una ráfaga no lleguen más eventos"""
+        while True:
+            diario = self.sistema.diario
+            if diario is None:
+                await asyncio.sleep(_ESPERA_SIN_DIARIO)
+                continue
+            # Con segundos_por_fsync=0 cada evento ya se sincroniza al registrarse: se evita un bucle sin espera
+            await asyncio.sleep(max(diario.segundos_hasta_fsync(), 0.001))
+            if self.sistema.diario is diario:
+                diario.sincronizar_si_vencido()
+
+    async def _ocupar_unidad(self, llamada: LlamadaEmergencia):
+        try:
+            await asyncio.sleep(llamada.tiempo_estimado_respuesta * self.segundos_por_minuto_respuesta)
+        finally:
+            self._unidades_libres.release()
+
+    def obtener_metricas(self) -> Dict[str, Any]:
+        """Contadores, profundidad de cola y percentiles de latencia llegada→despacho en milisegundos"""
+        latencias = sorted(self.latencias_ns)
+        metricas = dict(self.metricas)
+        metricas['profundidad_actual'] = len(self.sistema.cola_prioridad)
+        metricas['unidades_ocupadas'] = len(self._atenciones)
+        metricas['latencia_ms'] = {
+            'p50': _percentil(latencias, 50) / 1e6,
+            'p99': _percentil(latencias, 99) / 1e6,
+            'max': (latencias[-1] if latencias else 0) / 1e6
+        }
+        return metricas
+
+    @staticmethod
+    async def enviar_llamadas(host: str, puerto: int, datos_llamadas: Iterable[Dict[str, Any]],
+                              llamadas_por_segundo: Optional[float] = None) -> int:
+        """Cliente de carga: envía llamadas a ritmo constante y devuelve cuántas fueron encoladas.
+        Los acuses se leen en una tarea concurrente: si se leyeran al final, con la cola llena el servidor
+        quedaría bloqueado en drain() esperando a que el cliente lea y ambos lados se bloquearían"""
+        lector, escritor = await asyncio.open_connection(host, puerto)
+
+        async def contar_encoladas() -> int:
+            encoladas = 0
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    return encoladas
+                encoladas += json.loads(linea).get('estado') == 'encolada'
+
+        tarea_acuses = asyncio.create_task(contar_encoladas())
+        intervalo = 1 / llamadas_por_segundo if llamadas_por_segundo else 0
+        try:
+            for datos_llamada in datos_llamadas:
+                escritor.write(json.dumps(datos_llamada, ensure_ascii=False).encode('utf-8') + b'\n')
+                await escritor.drain()
+                if intervalo:
+                    await asyncio.sleep(intervalo)
+            # El servidor cierra la conexión al ver el fin de escritura, después de enviar el último acuse
+            escritor.write_eof()
+            return await tarea_acuses
+        finally:
+            tarea_acuses.cancel()
+            escritor.close()
+            await escritor.wait_closed()
+
+
+def _percentil_lineal(valores_ordenados: List[float], percentil: float) -> float:
+    """Percentil con interpolación lineal (mismo criterio que np.percentile por defecto)"""
+    if not valores_ordenados:
+        return 0.0
+    posicion = (len(valores_ordenados) - 1) * percentil / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(valores_ordenados) - 1)
+    return float(valores_ordenados[inferior] + (valores_ordenados[superior] - valores_ordenados[inferior]) * (posicion - inferior))
+
+
+def _percentil(valores_ordenados: List[int], percentil: float) -> int:
+    if not valores_ordenados:
+        return 0
+    indice = min(len(valores_ordenados) - 1, int(len(valores_ordenados) * percentil / 100))
+    return valores_ordenados[indice]
+
+
+async def ejecutar_servicio(puerto: int = 9911, unidades: int = 4, intervalo_metricas: float = 5.0):
+    """Ejecuta el servicio de despacho en vivo e imprime métricas periódicamente"""
+    servicio = ServicioDespachoAsync(SistemaDespachoEmergencias(), unidades=unidades)
+    direccion = await servicio.iniciar(puerto=puerto)
+    print(f"Servicio de despacho escuchando en {direccion[0]}:{direccion[1]}")
+    try:
+        while True:
+            await asyncio.sleep(intervalo_metricas)
+            print(f"Métricas: {json.dumps(servicio.obtener_metricas(), ensure_ascii=False)}")
+    finally:
+        await servicio.detener()
+
+
+def _serializacion_modo(modo: str) -> str:
+    """'compacto' y 'jsonl' comparten la serialización de cada fila"""
+    return 'indentado' if modo == 'indentado' else 'compacto'
+
+
+def _serializar_fila_reporte(fila: Dict[str, Any], modo: str) -> str:
+    if modo == 'indentado':
+        return json.dumps(fila, indent=2, ensure_ascii=False, default=str).replace('\n', '\n    ')
+    return json.dumps(fila, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def _ordenar_bloque_reporte(llamadas: List[LlamadaEmergencia], desplazamiento: int = 0,
+                            modo_serializado: str = 'indentado') -> Tuple[array, List[str]]:
+    """Tarea de proceso: ordena un bloque con timsort y devuelve sus índices globales en ese orden junto con
+    sus filas de reporte ya serializadas (cadenas, mucho más baratas de transferir que dicts)"""
+    clave = SistemaDespachoEmergencias._clave_ordenamiento_llamada
+    orden = sorted(range(len(llamadas)), key=lambda i: clave(llamadas[i]))
+    indices = array('q', [desplazamiento + i for i in orden])
+    construir_fila = SistemaDespachoEmergencias._construir_fila_reporte
+    return indices, [_serializar_fila_reporte(construir_fila(llamadas[i]), modo_serializado) for i in orden]
+
+
+def _ordenar_rango_compartido(rango: Tuple[int, int],
+                              modo_serializado: str = 'indentado') -> Tuple[array, List[str]]:
+    inicio, fin = rango
+    return _ordenar_bloque_reporte(_LLAMADAS_COMPARTIDAS[inicio:fin], inicio, modo_serializado)
+
+
 def main():
     """Función principal para ejecutar el sistema de despacho de emergencias"""
+    configurar_registro(logging.WARNING if '--silencioso' in sys.argv else logging.INFO)
     sistema = SistemaDespachoEmergencias()
+    if '--metricas' in sys.argv:
+        sistema.habilitar_instrumentacion(SumideroJSON('metricas_despacho.json'))
 
-    sistema.cargar_llamadas_desde_json('calls.json')
+    sistema.cargar_llamadas_streaming('calls.json')
 
     sistema.procesar_todas_llamadas()
 
@@ -297,21 +2114,31 @@ def main():
 
     sistema.imprimir_registro()
 
+    if sistema.instrumentacion is not None:
+        sistema.instrumentacion.emitir()
+        print("\nMétricas de instrumentación guardadas en metricas_despacho.json")
+
     print("\n" + "=" * 100)
     print("ANÁLISIS DE COMPLEJIDAD")
     print("=" * 100)
     print("1. Operaciones de Cola de Prioridad:")
-    print("   - Inserción (heapq.heappush): O(log n)")
-    print("   - Extracción (heapq.heappop): O(log n)")
+    print("   - Inserción (heap indexado): O(log n)")
+    print("   - Extracción (heap indexado): O(log n)")
+    print("   - Repriorizar / cancelar por id: O(log n)")
     print("   - Total para n llamadas: O(n log n)")
+    print("   - Carga en streaming con heapify único: O(n)")
     print()
     print("2. Algoritmos de Ordenamiento:")
     print("   - QuickSort (iterativo): Promedio O(n log n), Peor caso O(n²)")
     print("   - MergeSort: Siempre O(n log n), estable, espacio O(n)")
     print("   - TimSort (integrado en Python): O(n log n), adaptativo, estable")
+    print("   - Radix LSD (conteo sobre tiempo y prioridad): O(n + k) más el desempate por grupo")
+    print("   - Introsort: O(n log n) garantizado, mediana de tres y partición de tres vías")
+    print("   - NumPy lexsort (opcional): O(n log n) vectorizado sobre columnas")
     print()
     print("3. Aplanamiento de Subtareas:")
-    print("   - Recorrido recursivo: O(m) donde m es el total de subtareas")
+    print("   - Recorrido iterativo con pila explícita: O(m) donde m es el total de subtareas")
+    print("   - Reportes posteriores: O(1) por llamada gracias a la caché")
     print()
     print("4. Complejidad de Espacio:")
     print("   - Cola de Prioridad: O(n)")
@@ -320,4 +2147,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == '--servicio':
+        asyncio.run(ejecutar_servicio(int(sys.argv[2]) if len(sys.argv) > 2 else 9911))
+    else:
+        main()
\ No newline at end of file
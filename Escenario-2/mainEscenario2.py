@@ -1,13 +1,134 @@
 import json
 import heapq
+import multiprocessing
+import operator
+import os
+import random
+import re
+import sqlite3
+import threading
+import unicodedata
+import weakref
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Set
+from functools import lru_cache
+from operator import attrgetter
+from typing import List, Dict, Any, Optional, Set, Tuple, Callable, Iterator
 import time
 import sys
 
 
+_INDICE_COMPARTIDO: Optional['IndiceRecomendaciones'] = None
+
+_ARTICULOS_INICIALES = ('el', 'la', 'los', 'las', 'lo', 'un', 'una', 'unos', 'unas', 'the')
+_CAMPOS_LIBRO = ('id', 'titulo', 'anio', 'popularidad', 'recomendaciones', 'ejemplares_disponibles', 'metadatos')
+_ALIAS_CRITERIO = {
+    'titulo': 'titulo, anio',
+    'anio': 'anio, titulo'
+}
+
+
+def _sin_acentos(texto: str) -> str:
+    # NFKD sin marcas combinantes; el texto ASCII no tiene nada que descomponer
+    if texto.isascii():
+        return texto
+    descompuesto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+@lru_cache(maxsize=65536)
+def clave_colacion(texto: str) -> str:
+    # Sin acentos, sin mayúsculas y sin artículo inicial
+    palabras = _sin_acentos(texto).casefold().split()
+    if len(palabras) > 1 and palabras[0] in _ARTICULOS_INICIALES:
+        palabras = palabras[1:]
+    return ' '.join(palabras)
+
+
+@lru_cache(maxsize=256)
+def _parsear_criterio(criterio: str) -> Tuple[Tuple[Tuple[str, ...], bool], ...]:
+    # "popularidad desc, metadatos.autor" -> ((('popularidad',), True), (('metadatos', 'autor'), False))
+    campos = []
+    for parte in _ALIAS_CRITERIO.get(criterio.strip(), criterio).split(','):
+        tokens = parte.split()
+        if not tokens or len(tokens) > 2 or (len(tokens) == 2 and tokens[1].lower() not in ('asc', 'desc')):
+            raise ValueError("Criterio de ordenamiento no válido")
+
+        ruta = tuple(tokens[0].split('.'))
+        if ruta[0] not in _CAMPOS_LIBRO or (len(ruta) > 1 and ruta[0] != 'metadatos'):
+            raise ValueError("Criterio de ordenamiento no válido")
+
+        campos.append((ruta, len(tokens) == 2 and tokens[1].lower() == 'desc'))
+    return tuple(campos)
+
+
+def _codificar_campo(valor: Any, descendente: bool = False) -> Tuple:
+    # Cada campo se codifica como (rango de tipo, valor) para que None, números y textos sean comparables
+    if valor is None:
+        return (0,)
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return (1, -valor) if descendente else (1, valor)
+
+    texto = clave_colacion(valor if isinstance(valor, str) else str(valor))
+    if descendente:
+        # Código negado por carácter y centinela 0: "abc" precede a "ab" en orden descendente
+        return (2, tuple(-ord(c) for c in texto) + (0,))
+    return (2, texto)
+
+
+@lru_cache(maxsize=65536)
+def normalizar_busqueda(texto: str) -> str:
+    # Como clave_colacion pero conservando artículos: sin acentos, sin mayúsculas y con espacios simples
+    return ' '.join(_sin_acentos(texto).casefold().split())
+
+
+@lru_cache(maxsize=256)
+def _campos_criterio(criterio: str) -> frozenset:
+    # Atributos de Libro de los que depende la clave de un criterio
+    return frozenset(ruta[0] for ruta, _ in _parsear_criterio(criterio))
+
+
+class _CampoOrdenable:
+    # Descriptor que se instala en Libro la primera vez que una clave de orden depende del campo; desde
+    # entonces, asignar el campo descarta solo las claves cacheadas cuyo criterio lo usa. Los campos que
+    # ningún criterio usa (p. ej. ejemplares_disponibles al ordenar por título) siguen siendo atributos simples
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.criterios: Set[str] = set()
+
+    def __get__(self, libro, tipo=None):
+        if libro is None:
+            return self
+        try:
+            return libro.__dict__[self.nombre]
+        except KeyError:
+            raise AttributeError(self.nombre) from None
+
+    def __set__(self, libro, valor):
+        libro.__dict__[self.nombre] = valor
+        claves = libro.__dict__.get('_claves_orden')
+        if claves:
+            for criterio in [criterio for criterio in claves if criterio in self.criterios]:
+                del claves[criterio]
+
+
+def construir_clave_orden(libro: 'Libro', criterio: str) -> Tuple:
+    clave = []
+    for ruta, descendente in _parsear_criterio(criterio):
+        valor = getattr(libro, ruta[0], None)
+        for campo in ruta[1:]:
+            valor = valor.get(campo) if isinstance(valor, dict) else None
+        clave.append(_codificar_campo(valor, descendente))
+    return tuple(clave)
+
+
 class Libro:
     def __init__(self, libro_data: Dict[str, Any]):
+        self._claves_orden: Dict[str, Tuple] = {}
         self.id = libro_data['id']
         self.titulo = libro_data['titulo']
         self.anio = libro_data['anio']
@@ -16,8 +137,24 @@ class Libro:
         self.ejemplares_disponibles = libro_data.get('ejemplares_disponibles', 0)
         self.metadatos = libro_data.get('metadatos', {})
 
+    def clave_orden(self, criterio: str = 'titulo') -> Tuple:
+        clave = self._claves_orden.get(criterio)
+        if clave is None:
+            for campo in _campos_criterio(criterio):
+                descriptor = Libro.__dict__.get(campo)
+                if not isinstance(descriptor, _CampoOrdenable):
+                    descriptor = _CampoOrdenable(campo)
+                    setattr(Libro, campo, descriptor)
+                descriptor.criterios.add(criterio)
+            clave = self._claves_orden[criterio] = construir_clave_orden(self, criterio)
+        return clave
+
+    def invalidar_claves_orden(self):
+        # Necesario tras modificar metadatos o recomendaciones en sitio, que no pasa por la asignación
+        self._claves_orden.clear()
+
     def __lt__(self, other):
-        return self.titulo < other.titulo
+        return self.clave_orden('titulo') < other.clave_orden('titulo')
 
 
 class Solicitud:
@@ -30,32 +167,811 @@ class Solicitud:
         self.tipo = solicitud_data.get('tipo', 'prestamo')
         self.procesada = False
         self.resultado = None
+        self.clave = (self.prioridad, self.timestamp, self.id)
 
     def __lt__(self, other):
-        if self.prioridad != other.prioridad:
-            return self.prioridad < other.prioridad
-        elif self.timestamp != other.timestamp:
-            return self.timestamp < other.timestamp
+        return self.clave < other.clave
+
+
+_clave_solicitud = attrgetter('clave')
+
+
+class LibroPersistente(Libro):
+    # Libro materializado desde un CatalogoSQLite: cada asignación de atributo lo marca como modificado
+    def __init__(self, libro_data: Dict[str, Any], almacen: 'CatalogoSQLite'):
+        object.__setattr__(self, '_almacen', None)
+        super().__init__(libro_data)
+        object.__setattr__(self, '_almacen', almacen)
+
+    def __setattr__(self, nombre, valor):
+        super().__setattr__(nombre, valor)
+        almacen = self.__dict__.get('_almacen')
+        if almacen is not None and not nombre.startswith('_'):
+            almacen.registrar_modificacion(self)
+
+    def marcar_modificado(self):
+        # Para cambios en sitio (metadatos, recomendaciones) que no pasan por __setattr__
+        self.invalidar_claves_orden()
+        if self._almacen is not None:
+            self._almacen.registrar_modificacion(self)
+
+
+class CatalogoSQLite(MutableMapping):
+    # Catálogo en un archivo SQLite con la interfaz de un dict: los libros se materializan bajo demanda
+    # en un LRU acotado y los modificados se escriben al desalojarse o al sincronizar. Mientras alguien
+    # conserve un libro desalojado, _vivos lo devuelve en lugar de leer una segunda copia de disco
+    def __init__(self, ruta: str, capacidad_cache: int = 10000):
+        self.ruta = ruta
+        self.capacidad_cache = capacidad_cache
+        self.conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.execute("PRAGMA synchronous=NORMAL")
+        self.conexion.execute(
+            "CREATE TABLE IF NOT EXISTS libros ("
+            "id TEXT PRIMARY KEY, titulo TEXT NOT NULL, anio INTEGER, popularidad REAL, "
+            "ejemplares_disponibles INTEGER, recomendaciones TEXT, metadatos TEXT)"
+        )
+        self.conexion.commit()
+
+        self.cache: OrderedDict = OrderedDict()
+        self.modificados: Dict[str, LibroPersistente] = {}
+        self._vivos: 'weakref.WeakValueDictionary[str, LibroPersistente]' = weakref.WeakValueDictionary()
+        self._cerrojo = threading.RLock()
+        self._total = self.conexion.execute("SELECT COUNT(*) FROM libros").fetchone()[0]
+        self.lecturas_disco = 0
+        self.escrituras_disco = 0
+
+    @staticmethod
+    def _a_fila(libro: Libro) -> Tuple:
+        return (libro.id, libro.titulo, libro.anio, libro.popularidad, libro.ejemplares_disponibles,
+                json.dumps(libro.recomendaciones), json.dumps(libro.metadatos, ensure_ascii=False))
+
+    def _materializar(self, fila: Tuple) -> LibroPersistente:
+        libro_id, titulo, anio, popularidad, ejemplares, recomendaciones, metadatos = fila
+        libro = LibroPersistente({
+            'id': libro_id,
+            'titulo': titulo,
+            'anio': anio,
+            'popularidad': popularidad,
+            'recomendaciones': json.loads(recomendaciones) if recomendaciones else [],
+            'ejemplares_disponibles': ejemplares,
+            'metadatos': json.loads(metadatos) if metadatos else {}
+        }, self)
+        self.lecturas_disco += 1
+        self._cachear(libro)
+        return libro
+
+    def _cachear(self, libro: LibroPersistente):
+        self.cache[libro.id] = libro
+        self._vivos[libro.id] = libro
+        self.cache.move_to_end(libro.id)
+        while len(self.cache) > self.capacidad_cache:
+            libro_id, desalojado = self.cache.popitem(last=False)
+            if self.modificados.pop(libro_id, None) is not None:
+                self._escribir([desalojado])
+
+    def _escribir(self, libros: List[Libro]):
+        # El upsert conserva el rowid, y con él el orden de inserción que expone __iter__
+        self.conexion.executemany(
+            "INSERT INTO libros VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+            "titulo = excluded.titulo, anio = excluded.anio, popularidad = excluded.popularidad, "
+            "ejemplares_disponibles = excluded.ejemplares_disponibles, "
+            "recomendaciones = excluded.recomendaciones, metadatos = excluded.metadatos",
+            [self._a_fila(libro) for libro in libros]
+        )
+        self.escrituras_disco += len(libros)
+
+    def registrar_modificacion(self, libro: LibroPersistente):
+        with self._cerrojo:
+            self.modificados[libro.id] = libro
+
+    def __getitem__(self, libro_id: str) -> LibroPersistente:
+        with self._cerrojo:
+            libro = self.cache.get(libro_id)
+            if libro is not None:
+                self.cache.move_to_end(libro_id)
+                return libro
+
+            # Un libro desalojado que sigue en uso (o modificado y sin sincronizar) es la versión vigente
+            libro = self._vivos.get(libro_id) or self.modificados.get(libro_id)
+            if libro is not None:
+                self._cachear(libro)
+                return libro
+
+            fila = self.conexion.execute("SELECT * FROM libros WHERE id = ?", (libro_id,)).fetchone()
+            if fila is None:
+                raise KeyError(libro_id)
+            return self._materializar(fila)
+
+    def __setitem__(self, libro_id: str, libro: Libro):
+        if libro_id != libro.id:
+            raise ValueError("La clave debe coincidir con el id del libro")
+
+        with self._cerrojo:
+            existe = libro_id in self
+            self._escribir([libro])
+            self.modificados.pop(libro_id, None)
+            if not existe:
+                self._total += 1
+
+            if not isinstance(libro, LibroPersistente) or libro._almacen is not self:
+                libro = LibroPersistente({
+                    'id': libro.id,
+                    'titulo': libro.titulo,
+                    'anio': libro.anio,
+                    'popularidad': libro.popularidad,
+                    'recomendaciones': libro.recomendaciones,
+                    'ejemplares_disponibles': libro.ejemplares_disponibles,
+                    'metadatos': libro.metadatos
+                }, self)
+            self._cachear(libro)
+
+    def __delitem__(self, libro_id: str):
+        with self._cerrojo:
+            cursor = self.conexion.execute("DELETE FROM libros WHERE id = ?", (libro_id,))
+            if cursor.rowcount == 0:
+                raise KeyError(libro_id)
+            self.cache.pop(libro_id, None)
+            self._vivos.pop(libro_id, None)
+            self.modificados.pop(libro_id, None)
+            self._total -= 1
+
+    def __contains__(self, libro_id: object) -> bool:
+        with self._cerrojo:
+            if libro_id in self.cache or libro_id in self._vivos or libro_id in self.modificados:
+                return True
+            return self.conexion.execute("SELECT 1 FROM libros WHERE id = ?", (libro_id,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._total
+
+    def __iter__(self) -> Iterator[str]:
+        for (libro_id,) in self.conexion.execute("SELECT id FROM libros ORDER BY rowid"):
+            yield libro_id
+
+    def items(self) -> Iterator[Tuple[str, LibroPersistente]]:
+        # Recorrido secuencial en una sola consulta; los libros ya en memoria se reutilizan
+        for fila in self.conexion.execute("SELECT * FROM libros ORDER BY rowid"):
+            with self._cerrojo:
+                libro = self.cache.get(fila[0]) or self._vivos.get(fila[0]) or self.modificados.get(fila[0])
+                if libro is None:
+                    libro = self._materializar(fila)
+            yield libro.id, libro
+
+    def values(self) -> Iterator[LibroPersistente]:
+        for _, libro in self.items():
+            yield libro
+
+    def importar_json(self, filename: str, tamano_lote: int = 10000) -> int:
+        with open(filename, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+
+        importados = 0
+        with self._cerrojo:
+            lote = []
+            for libro_data in data.get('libros', []):
+                lote.append(Libro(libro_data))
+                if len(lote) >= tamano_lote:
+                    self._escribir(lote)
+                    importados += len(lote)
+                    lote = []
+            if lote:
+                self._escribir(lote)
+                importados += len(lote)
+
+            self.conexion.commit()
+            self.cache.clear()
+            self._vivos.clear()
+            self.modificados.clear()
+            self._total = self.conexion.execute("SELECT COUNT(*) FROM libros").fetchone()[0]
+        return importados
+
+    def sincronizar(self):
+        with self._cerrojo:
+            if self.modificados:
+                self._escribir(list(self.modificados.values()))
+                self.modificados.clear()
+            self.conexion.commit()
+
+    def cerrar(self):
+        self.sincronizar()
+        self.conexion.close()
+
+    def estadisticas(self) -> Dict[str, int]:
+        return {
+            'libros': self._total,
+            'en_memoria': len(self.cache),
+            'vivos': len(self._vivos),
+            'modificados': len(self.modificados),
+            'lecturas_disco': self.lecturas_disco,
+            'escrituras_disco': self.escrituras_disco
+        }
+
+
+class IndiceRecomendaciones:
+    # Grafo de recomendaciones en formato CSR: los vecinos del libro i son indices[indptr[i]:indptr[i + 1]]
+    def __init__(self, catalogo: MutableMapping):
+        # Una sola pasada por items(): con un catálogo en disco es un único recorrido secuencial
+        self.ids: List[str] = []
+        self.popularidades = array('d')
+        recomendaciones_por_libro = []
+        for libro_id, libro in catalogo.items():
+            self.ids.append(libro_id)
+            self.popularidades.append(libro.popularidad or 0.0)
+            recomendaciones_por_libro.append(libro.recomendaciones)
+
+        self.posiciones: Dict[str, int] = {libro_id: i for i, libro_id in enumerate(self.ids)}
+        self.indptr = array('l', [0])
+        self.indices = array('l')
+
+        for recomendaciones in recomendaciones_por_libro:
+            for recomendacion_id in recomendaciones:
+                posicion = self.posiciones.get(recomendacion_id)
+                if posicion is not None:
+                    self.indices.append(posicion)
+            self.indptr.append(len(self.indices))
+
+        # Cotas para la poda del ranking: mayor popularidad entre los vecinos de cada libro y en todo el grafo
+        self.max_popularidad_vecinos = array('d', (
+            max((self.popularidades[vecino] for vecino in self.vecinos(i)), default=0.0) for i in range(len(self.ids))
+        ))
+        self.max_popularidad = max(self.popularidades, default=0.0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def vecinos(self, posicion: int) -> array:
+        return self.indices[self.indptr[posicion]:self.indptr[posicion + 1]]
+
+    def recorrer(self, libro_id: str, profundidad_maxima: int) -> List[Tuple[str, int]]:
+        origen = self.posiciones.get(libro_id)
+        if origen is None:
+            return []
+
+        # BFS por niveles: cada libro aparece una sola vez, con su distancia mínima al origen
+        indptr, indices = self.indptr, self.indices
+        visitados = {origen}
+        frontera = [origen]
+        resultado = []
+
+        for distancia in range(1, profundidad_maxima + 1):
+            siguiente = []
+            for nodo in frontera:
+                for vecino in indices[indptr[nodo]:indptr[nodo + 1]]:
+                    if vecino not in visitados:
+                        visitados.add(vecino)
+                        siguiente.append(vecino)
+
+            if not siguiente:
+                break
+
+            resultado.extend((self.ids[vecino], distancia) for vecino in siguiente)
+            frontera = siguiente
+
+        return resultado
+
+    def recorrer_ponderado(self, libro_id: str, k: int = 10, decaimiento: float = 0.5,
+                           profundidad_maxima: Optional[int] = None,
+                           admitir: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, int, float]]:
+        # Puntuación = popularidad * decaimiento^(distancia - 1), con el top-k en un min-heap acotado.
+        # Dentro de cada nivel se expanden primero los libros con vecinos más populares, y el recorrido
+        # se corta en cuanto ni sus vecinos ni los niveles más profundos pueden superar al k-ésimo.
+        # Esas cotas solo valen si la puntuación no crece con la distancia, de ahí 0 < decaimiento <= 1
+        if not 0 < decaimiento <= 1:
+            raise ValueError(f"Decaimiento no válido: {decaimiento}")
+        origen = self.posiciones.get(libro_id)
+        if origen is None or k <= 0:
+            return []
+
+        indptr, indices = self.indptr, self.indices
+        popularidades, max_vecinos = self.popularidades, self.max_popularidad_vecinos
+        mejores: List[Tuple[float, int, int, int]] = []
+        visitados = {origen}
+        frontera = [origen]
+        distancia = 0
+        descubiertos = 0
+
+        while frontera and (profundidad_maxima is None or distancia < profundidad_maxima):
+            factor = decaimiento ** distancia
+            ultimo_nivel = profundidad_maxima is not None and distancia + 1 >= profundidad_maxima
+            cota_profunda = 0.0 if ultimo_nivel else self.max_popularidad * factor * decaimiento
+            frontera.sort(key=lambda nodo: -max_vecinos[nodo])
+            siguiente = []
+
+            for nodo in frontera:
+                if len(mejores) == k:
+                    umbral = mejores[0][0]
+                    # La frontera está ordenada por cota descendente: el resto tampoco puede entrar
+                    if max_vecinos[nodo] * factor <= umbral and cota_profunda <= umbral:
+                        break
+
+                for vecino in indices[indptr[nodo]:indptr[nodo + 1]]:
+                    if vecino in visitados:
+                        continue
+                    visitados.add(vecino)
+                    siguiente.append(vecino)
+
+                    if admitir is not None and not admitir(self.ids[vecino]):
+                        continue
+                    # A igual puntuación gana el descubierto antes (-orden mayor)
+                    entrada = (popularidades[vecino] * factor, -descubiertos, vecino, distancia + 1)
+                    descubiertos += 1
+                    if len(mejores) < k:
+                        heapq.heappush(mejores, entrada)
+                    elif entrada > mejores[0]:
+                        heapq.heapreplace(mejores, entrada)
+
+            frontera = siguiente
+            distancia += 1
+
+        return [(self.ids[posicion], distancia_libro, puntuacion)
+                for puntuacion, _, posicion, distancia_libro in sorted(mejores, reverse=True)]
+
+
+class IndiceOrdenado:
+    # Lista ordenada por bloques: bisect sobre el máximo de cada bloque y luego dentro del bloque.
+    # Cada entrada es (clave, libro_id), así que las entradas son únicas aunque la clave se repita
+    def __init__(self, clave: Callable[[Libro], Tuple], tamano_bloque: int = 512,
+                 codificar_limite: Optional[Callable[[Any], Any]] = None):
+        self.clave = clave
+        self.codificar_limite = codificar_limite
+        self.tamano_bloque = tamano_bloque
+        self.bloques: List[List[Tuple[Tuple, str]]] = []
+        self.maximos: List[Tuple[Tuple, str]] = []
+        self.entradas: Dict[str, Tuple[Tuple, str]] = {}
+
+    def __len__(self):
+        return len(self.entradas)
+
+    def __contains__(self, libro_id: str):
+        return libro_id in self.entradas
+
+    def construir(self, libros: Iterator[Libro]):
+        self.entradas = {libro.id: (self.clave(libro), libro.id) for libro in libros}
+        ordenadas = sorted(self.entradas.values())
+        self.bloques = [ordenadas[i:i + self.tamano_bloque] for i in range(0, len(ordenadas), self.tamano_bloque)]
+        self.maximos = [bloque[-1] for bloque in self.bloques]
+
+    def agregar(self, libro: Libro):
+        if libro.id in self.entradas:
+            self.eliminar(libro.id)
+
+        entrada = (self.clave(libro), libro.id)
+        self.entradas[libro.id] = entrada
+
+        if not self.bloques:
+            self.bloques.append([entrada])
+            self.maximos.append(entrada)
+            return
+
+        i = min(bisect_left(self.maximos, entrada), len(self.bloques) - 1)
+        bloque = self.bloques[i]
+        insort(bloque, entrada)
+        self.maximos[i] = bloque[-1]
+
+        if len(bloque) > 2 * self.tamano_bloque:
+            mitad = len(bloque) // 2
+            self.bloques.insert(i + 1, bloque[mitad:])
+            del bloque[mitad:]
+            self.maximos.insert(i, bloque[-1])
+
+    def eliminar(self, libro_id: str) -> bool:
+        entrada = self.entradas.pop(libro_id, None)
+        if entrada is None:
+            return False
+
+        i = bisect_left(self.maximos, entrada)
+        bloque = self.bloques[i]
+        del bloque[bisect_left(bloque, entrada)]
+
+        if bloque:
+            self.maximos[i] = bloque[-1]
+        else:
+            del self.bloques[i]
+            del self.maximos[i]
+        return True
+
+    def actualizar(self, libro: Libro):
+        if self.entradas.get(libro.id) != (self.clave(libro), libro.id):
+            self.agregar(libro)
+
+    def iterar(self, desplazamiento: int = 0, descendente: bool = False) -> Iterator[str]:
+        bloques = reversed(self.bloques) if descendente else self.bloques
+        for bloque in bloques:
+            if desplazamiento >= len(bloque):
+                desplazamiento -= len(bloque)
+                continue
+
+            entradas = bloque[::-1] if descendente else bloque
+            for _, libro_id in entradas[desplazamiento:]:
+                yield libro_id
+            desplazamiento = 0
+
+    def pagina(self, desplazamiento: int = 0, limite: int = 50, descendente: bool = False) -> List[str]:
+        resultado = []
+        if limite <= 0:
+            return resultado
+
+        for libro_id in self.iterar(desplazamiento, descendente):
+            resultado.append(libro_id)
+            if len(resultado) >= limite:
+                break
+        return resultado
+
+    def _iterar_desde(self, inicio: Tuple) -> Iterator[Tuple[Tuple, str]]:
+        i = bisect_left(self.maximos, inicio)
+        j = bisect_left(self.bloques[i], inicio) if i < len(self.bloques) else 0
+
+        while i < len(self.bloques):
+            yield from self.bloques[i][j:]
+            i += 1
+            j = 0
+
+    def rango(self, desde: Any, hasta: Any) -> List[str]:
+        # Rango inclusivo sobre el primer campo de la clave
+        if self.codificar_limite is not None:
+            desde, hasta = sorted((self.codificar_limite(desde), self.codificar_limite(hasta)))
+
+        resultado = []
+        for clave, libro_id in self._iterar_desde(((desde,),)):
+            if clave[0] > hasta:
+                break
+            resultado.append(libro_id)
+        return resultado
+
+    def prefijo(self, prefijo: str, limite: Optional[int] = None) -> List[str]:
+        # Para claves cuyo primer campo es texto: todas las entradas que empiezan por el prefijo, en orden
+        resultado = []
+        for clave, libro_id in self._iterar_desde(((prefijo,),)):
+            if not clave[0].startswith(prefijo) or (limite is not None and len(resultado) >= limite):
+                break
+            resultado.append(libro_id)
+        return resultado
+
+
+_OPERADORES_BUSQUEDA = {
+    '=': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge
+}
+_TERMINO_BUSQUEDA = re.compile(r'^\s*([\w.]+)\s*(<=|>=|!=|=|<|>|~)\s*(.+?)\s*$')
+# Campos que cambian al procesar solicitudes: se evalúan en vivo sobre el catálogo en lugar de indexarse
+_CAMPOS_BUSQUEDA_EN_VIVO = ('ejemplares_disponibles',)
+
+
+def _valor_busqueda(libro: Libro, campo: str) -> Any:
+    if campo in _CAMPOS_LIBRO:
+        return getattr(libro, campo, None)
+    return libro.metadatos.get(campo) if isinstance(libro.metadatos, dict) else None
+
+
+class IndiceBusqueda:
+    # Índice invertido de tokens (sin acentos ni mayúsculas) por campo, valores exactos por campo,
+    # índices ordenados para campos numéricos y dos índices de prefijo de título (con y sin artículo)
+    def __init__(self):
+        self.tokens: Dict[str, Dict[str, Set[str]]] = {'*': {}}
+        self.valores: Dict[str, Dict[str, Set[str]]] = {}
+        self.numericos: Dict[str, IndiceOrdenado] = {}
+        self.titulos = IndiceOrdenado(lambda libro: (normalizar_busqueda(libro.titulo),))
+        self.titulos_sin_articulo = IndiceOrdenado(lambda libro: (clave_colacion(libro.titulo),))
+        self.documentos: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self):
+        return len(self.documentos)
+
+    @staticmethod
+    def _campos_texto(libro: Libro) -> Iterator[Tuple[str, str]]:
+        yield 'titulo', libro.titulo
+        if isinstance(libro.metadatos, dict):
+            for campo, valor in libro.metadatos.items():
+                if isinstance(valor, str):
+                    yield campo, valor
+
+    @staticmethod
+    def _valores_numericos(libro: Libro) -> Dict[str, Any]:
+        valores = {'anio': libro.anio, 'popularidad': libro.popularidad}
+        if isinstance(libro.metadatos, dict):
+            for campo, valor in libro.metadatos.items():
+                if isinstance(valor, (int, float)) and not isinstance(valor, bool) and campo not in _CAMPOS_LIBRO:
+                    valores[campo] = valor
+        return valores
+
+    def _indice_numerico(self, campo: str) -> IndiceOrdenado:
+        indice = self.numericos.get(campo)
+        if indice is None:
+            indice = self.numericos[campo] = IndiceOrdenado(
+                lambda libro: (_codificar_campo(_valor_busqueda(libro, campo)),),
+                codificar_limite=_codificar_campo
+            )
+        return indice
+
+    def _indexar_texto(self, libro: Libro) -> Dict[str, str]:
+        textos = {}
+        for campo, valor in self._campos_texto(libro):
+            normalizado = normalizar_busqueda(valor)
+            textos[campo] = normalizado
+            self.valores.setdefault(campo, {}).setdefault(normalizado, set()).add(libro.id)
+            tokens_campo = self.tokens.setdefault(campo, {})
+            for token in re.findall(r'\w+', normalizado):
+                tokens_campo.setdefault(token, set()).add(libro.id)
+                self.tokens['*'].setdefault(token, set()).add(libro.id)
+        return textos
+
+    def construir(self, libros: Iterator[Libro]):
+        self.__init__()
+        libros = list(libros)
+        numericos: Dict[str, List[Libro]] = {}
+
+        for libro in libros:
+            valores = self._valores_numericos(libro)
+            self.documentos[libro.id] = {'textos': self._indexar_texto(libro), 'numericos': valores}
+            for campo in valores:
+                numericos.setdefault(campo, []).append(libro)
+
+        for campo, libros_campo in numericos.items():
+            self._indice_numerico(campo).construir(libros_campo)
+        self.titulos.construir(libros)
+        self.titulos_sin_articulo.construir(libros)
+
+    def agregar(self, libro: Libro):
+        if libro.id in self.documentos:
+            self.eliminar(libro.id)
+
+        valores = self._valores_numericos(libro)
+        self.documentos[libro.id] = {'textos': self._indexar_texto(libro), 'numericos': valores}
+        for campo in valores:
+            self._indice_numerico(campo).agregar(libro)
+        self.titulos.agregar(libro)
+        self.titulos_sin_articulo.agregar(libro)
+
+    def eliminar(self, libro_id: str) -> bool:
+        documento = self.documentos.pop(libro_id, None)
+        if documento is None:
+            return False
+
+        for campo, normalizado in documento['textos'].items():
+            _descartar(self.valores[campo], normalizado, libro_id)
+            for token in re.findall(r'\w+', normalizado):
+                _descartar(self.tokens[campo], token, libro_id)
+                _descartar(self.tokens['*'], token, libro_id)
+        for campo in documento['numericos']:
+            self.numericos[campo].eliminar(libro_id)
+        self.titulos.eliminar(libro_id)
+        self.titulos_sin_articulo.eliminar(libro_id)
+        return True
+
+    def prefijo_titulo(self, prefijo: str, limite: int = 20) -> List[str]:
+        # "el ale" encuentra "El Aleph" por el título completo y "aleph" lo encuentra sin el artículo
+        ids = self.titulos.prefijo(normalizar_busqueda(prefijo), limite)
+        ids.extend(self.titulos_sin_articulo.prefijo(clave_colacion(prefijo), limite))
+        return list(dict.fromkeys(ids))[:limite]
+
+    def consultar(self, consulta: str, catalogo: MutableMapping) -> Set[str]:
+        # Términos unidos por AND: "genero=Realismo mágico AND anio<1970", "autor~borges", o texto libre.
+        # Los conjuntos de tokens y valores exactos se intersectan primero; las comparaciones numéricas y
+        # las desigualdades solo recorren un índice si no hay otro término que acote los candidatos
+        conjuntos = []
+        numericos = []
+        distintos = []
+        filtros_en_vivo = []
+
+        for termino in re.split(r'\s+AND\s+', consulta.strip()):
+            coincidencia = _TERMINO_BUSQUEDA.match(termino)
+            if coincidencia is None:
+                conjuntos.append(self._buscar_tokens('*', termino))
+                continue
+
+            campo, operador, valor = coincidencia.groups()
+            if campo.startswith('metadatos.'):
+                campo = campo[len('metadatos.'):]
+
+            if campo in _CAMPOS_BUSQUEDA_EN_VIVO:
+                filtros_en_vivo.append((campo, _OPERADORES_BUSQUEDA[operador], _numero(valor)))
+            elif operador == '~':
+                conjuntos.append(self._buscar_tokens(campo, valor))
+            elif campo in self.numericos:
+                numericos.append((campo, operador, _numero(valor)))
+            elif campo in self.valores and operador == '=':
+                conjuntos.append(self.valores[campo].get(normalizar_busqueda(valor), set()))
+            elif campo in self.valores and operador == '!=':
+                distintos.append((campo, normalizar_busqueda(valor)))
+            else:
+                raise ValueError(f"Término de búsqueda no válido: {termino}")
+
+        if conjuntos:
+            # Intersección empezando por el conjunto más pequeño
+            conjuntos.sort(key=len)
+            resultado = set(conjuntos[0])
+            for conjunto in conjuntos[1:]:
+                if not resultado:
+                    break
+                resultado &= conjunto
+        elif numericos:
+            resultado = self._buscar_numerico(*numericos.pop(0))
+        else:
+            resultado = set(self.documentos)
+
+        for campo, operador, valor in numericos:
+            comparar = _OPERADORES_BUSQUEDA[operador]
+            resultado = {libro_id for libro_id in resultado
+                         if _comparar_numero(comparar, self.documentos[libro_id]['numericos'].get(campo), valor)}
+        for campo, valor in distintos:
+            resultado = {libro_id for libro_id in resultado
+                         if self.documentos[libro_id]['textos'].get(campo) != valor}
+        for campo, comparar, valor in filtros_en_vivo:
+            resultado = {libro_id for libro_id in resultado
+                         if _comparar_numero(comparar, _valor_busqueda(catalogo[libro_id], campo), valor)}
+        return resultado
+
+    def _buscar_tokens(self, campo: str, texto: str) -> Set[str]:
+        tokens_campo = self.tokens.get(campo)
+        if tokens_campo is None:
+            raise ValueError(f"Campo de búsqueda no válido: {campo}")
+
+        tokens = re.findall(r'\w+', normalizar_busqueda(texto))
+        conjuntos = sorted((tokens_campo.get(token, set()) for token in tokens), key=len)
+        if not conjuntos:
+            return set()
+        resultado = set(conjuntos[0])
+        for conjunto in conjuntos[1:]:
+            resultado &= conjunto
+        return resultado
+
+    def _buscar_numerico(self, campo: str, operador: str, valor: float) -> Set[str]:
+        indice = self.numericos[campo]
+        iguales = set(indice.rango(valor, valor))
+        if operador == '=':
+            return iguales
+        if operador == '!=':
+            return set(self.documentos) - iguales
+        if operador in ('<', '<='):
+            ids = set(indice.rango(float('-inf'), valor))
         else:
-            return self.id < other.id
+            ids = set(indice.rango(valor, float('inf')))
+        return ids - iguales if operador in ('<', '>') else ids
+
+
+def _descartar(indice: Dict[str, Set[str]], clave: str, libro_id: str):
+    ids = indice.get(clave)
+    if ids is not None:
+        ids.discard(libro_id)
+        if not ids:
+            del indice[clave]
+
+
+def _comparar_numero(comparar: Callable[[Any, Any], bool], valor: Any, referencia: float) -> bool:
+    if not isinstance(valor, (int, float)) or isinstance(valor, bool):
+        return comparar is operator.ne
+    return comparar(valor, referencia)
+
+
+def _numero(texto: str) -> float:
+    try:
+        return int(texto)
+    except ValueError:
+        try:
+            return float(texto)
+        except ValueError:
+            raise ValueError(f"Valor numérico no válido: {texto}")
+
+
+class CacheRecomendaciones:
+    # LRU con TTL opcional; cada entrada registra los libros de los que depende para invalidarla con precisión
+    def __init__(self, capacidad: int = 1024, ttl_segundos: Optional[float] = None):
+        self.capacidad = capacidad
+        self.ttl_segundos = ttl_segundos
+        self.entradas: OrderedDict = OrderedDict()
+        self.dependientes: Dict[str, Set[Tuple[str, int]]] = {}
+        self.aciertos = 0
+        self.fallos = 0
+        self.expiradas = 0
+        self.desalojadas = 0
+        self.invalidadas = 0
+
+    def __len__(self):
+        return len(self.entradas)
+
+    def obtener(self, clave: Tuple[str, int]) -> Optional[Dict[str, Any]]:
+        entrada = self.entradas.get(clave)
+        if entrada is None:
+            self.fallos += 1
+            return None
+
+        if entrada['expira'] is not None and entrada['expira'] <= time.monotonic():
+            self._quitar(clave)
+            self.expiradas += 1
+            self.fallos += 1
+            return None
+
+        self.entradas.move_to_end(clave)
+        self.aciertos += 1
+        return entrada
+
+    def guardar(self, clave: Tuple[str, int], resultado: List[Tuple[str, int]],
+                dependencias: Set[str]) -> Dict[str, Any]:
+        if clave in self.entradas:
+            self._quitar(clave)
+
+        expira = time.monotonic() + self.ttl_segundos if self.ttl_segundos is not None else None
+        # El resultado se guarda como tupla para que ningún llamador pueda modificar la copia en caché
+        entrada = {'resultado': tuple(resultado), 'filas': None, 'dependencias': dependencias, 'expira': expira}
+        self.entradas[clave] = entrada
+        for libro_id in dependencias:
+            self.dependientes.setdefault(libro_id, set()).add(clave)
+
+        while len(self.entradas) > self.capacidad:
+            clave_antigua = next(iter(self.entradas))
+            self._quitar(clave_antigua)
+            self.desalojadas += 1
+
+        return entrada
+
+    def invalidar(self, libro_id: str):
+        for clave in list(self.dependientes.get(libro_id, ())):
+            self._quitar(clave)
+            self.invalidadas += 1
+
+    def limpiar(self):
+        self.entradas.clear()
+        self.dependientes.clear()
+
+    def _quitar(self, clave: Tuple[str, int]):
+        entrada = self.entradas.pop(clave)
+        for libro_id in entrada['dependencias']:
+            claves = self.dependientes.get(libro_id)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self.dependientes[libro_id]
+
+    def estadisticas(self) -> Dict[str, Any]:
+        consultas = self.aciertos + self.fallos
+        return {
+            'entradas': len(self.entradas),
+            'capacidad': self.capacidad,
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'tasa_aciertos': self.aciertos / consultas if consultas else 0.0,
+            'expiradas': self.expiradas,
+            'desalojadas': self.desalojadas,
+            'invalidadas': self.invalidadas
+        }
 
 
 class SistemaBiblioteca:
-    def __init__(self):
-        self.catalogo: Dict[str, Libro] = {}  
+    def __init__(self, capacidad_cache_recomendaciones: int = 1024,
+                 ttl_cache_recomendaciones: Optional[float] = None, franjas_cerrojos: int = 64,
+                 catalogo: Optional[MutableMapping] = None):
+        # Cualquier MutableMapping de id a Libro sirve como catálogo, p. ej. un CatalogoSQLite
+        self.catalogo: MutableMapping = catalogo if catalogo is not None else {}
         self.solicitudes_heap = [] 
-        self.solicitudes_procesadas = []  
+        self._solicitudes_procesadas: List[Solicitud] = []
+        # Colas por libro ya resueltas cuyo orden global aún no se ha reconstruido
+        self._colas_sin_fusionar: List[List[Solicitud]] = []
+        # Reservas sin ejemplar, en un min-heap por libro a la espera de devoluciones
+        self.listas_espera: Dict[str, List[Solicitud]] = {}
         self.libros_ordenados = [] 
+        self._indice_recomendaciones: Optional[IndiceRecomendaciones] = None
+        self.cache_recomendaciones = CacheRecomendaciones(capacidad_cache_recomendaciones, ttl_cache_recomendaciones)
+        self.indices_catalogo: Dict[str, IndiceOrdenado] = {}
+        self._indice_busqueda: Optional[IndiceBusqueda] = None
+        # Cerrojos por franjas: libros distintos casi nunca comparten cerrojo al atender en paralelo
+        self._cerrojos_libros = [threading.Lock() for _ in range(franjas_cerrojos)]
+        self._cerrojo_registro = threading.Lock()
 
     def cargar_catalogo(self, filename: str):
         try:
-            with open(filename, 'r', encoding='utf-8') as file:
-                data = json.load(file)
+            if isinstance(self.catalogo, CatalogoSQLite):
+                self.catalogo.importar_json(filename)
+            else:
+                with open(filename, 'r', encoding='utf-8') as file:
+                    data = json.load(file)
 
-            for libro_data in data.get('libros', []):
-                libro = Libro(libro_data)
-                self.catalogo[libro.id] = libro
+                for libro_data in data.get('libros', []):
+                    libro = Libro(libro_data)
+                    self.catalogo[libro.id] = libro
 
+            self.invalidar_indice_recomendaciones()
+            self.indices_catalogo.clear()
+            self._indice_busqueda = None
             print(f"Catálogo cargado: {len(self.catalogo)} libros")
 
         except Exception as e:
@@ -92,6 +1008,9 @@ class SistemaBiblioteca:
                 libro.ejemplares_disponibles -= 1
                 solicitud.resultado = "éxito"
                 exitosas += 1
+            elif solicitud.tipo == 'reserva' and libro:
+                solicitud.resultado = "en_espera"
+                heapq.heappush(self.listas_espera.setdefault(solicitud.libro_id, []), solicitud)
             else:
                 solicitud.resultado = "sin_ejemplares"
 
@@ -104,29 +1023,317 @@ class SistemaBiblioteca:
 
         print(f"Procesamiento completado: {procesadas} solicitudes, {exitosas} exitosas")
 
+    def procesar_solicitudes_por_libro(self):
+        print("Procesando solicitudes por libro...")
+        colas: Dict[str, List[Solicitud]] = {}
+        for solicitud in self.solicitudes_heap:
+            colas.setdefault(solicitud.libro_id, []).append(solicitud)
+        self.solicitudes_heap = []
+
+        procesadas = 0
+        exitosas = 0
+        for libro_id, cola in colas.items():
+            with self._cerrojo_libro(libro_id):
+                exitosas += self._resolver_cola_libro(libro_id, cola)
+            procesadas += len(cola)
+
+        self._colas_sin_fusionar.extend(colas.values())
+        print(f"Procesamiento completado: {procesadas} solicitudes, {exitosas} exitosas")
+
+    def _resolver_cola_libro(self, libro_id: str, cola: List[Solicitud]) -> int:
+        # Las primeras ejemplares_disponibles solicitudes (en orden de prioridad) tienen éxito; el resto se
+        # marca sin_ejemplares en bloque. Solo se ordena la cola cuando el corte cae dentro de ella.
+        # Quien llama debe tener el cerrojo del libro, para que la búsqueda y el descuento sean atómicos
+        libro = self.catalogo.get(libro_id)
+        disponibles = max(libro.ejemplares_disponibles, 0) if libro else 0
+
+        if disponibles >= len(cola):
+            atendidas, rechazadas = cola, []
+        elif disponibles == 0:
+            atendidas, rechazadas = [], cola
+        else:
+            cola.sort(key=_clave_solicitud)
+            atendidas, rechazadas = cola[:disponibles], cola[disponibles:]
+
+        for solicitud in atendidas:
+            solicitud.resultado = "éxito"
+            solicitud.procesada = True
+        reservas = []
+        for solicitud in rechazadas:
+            if solicitud.tipo == 'reserva' and libro:
+                solicitud.resultado = "en_espera"
+                reservas.append(solicitud)
+            else:
+                solicitud.resultado = "sin_ejemplares"
+            solicitud.procesada = True
+
+        if reservas:
+            espera = self.listas_espera.setdefault(libro_id, [])
+            espera.extend(reservas)
+            heapq.heapify(espera)
+
+        if atendidas:
+            libro.ejemplares_disponibles -= len(atendidas)
+        return len(atendidas)
+
+    def devolver(self, libro_id: str, cantidad: int = 1) -> List[Solicitud]:
+        # Cada ejemplar devuelto pasa a la mejor reserva en espera (orden de Solicitud.__lt__) en O(log n)
+        if cantidad < 1:
+            raise ValueError(f"Cantidad de ejemplares devueltos no válida: {cantidad}")
+        atendidas = []
+        with self._cerrojo_libro(libro_id):
+            libro = self.catalogo.get(libro_id)
+            if libro is None:
+                raise KeyError(f"Libro {libro_id} no encontrado")
+            libro.ejemplares_disponibles += cantidad
+            espera = self.listas_espera.get(libro_id)
+
+            while espera and libro.ejemplares_disponibles > 0:
+                solicitud = heapq.heappop(espera)
+                solicitud.resultado = "éxito"
+                libro.ejemplares_disponibles -= 1
+                atendidas.append(solicitud)
+
+            if espera is not None and not espera:
+                del self.listas_espera[libro_id]
+        return atendidas
+
+    def _cerrojo_libro(self, libro_id: str) -> threading.Lock:
+        return self._cerrojos_libros[hash(libro_id) % len(self._cerrojos_libros)]
+
+    def atender_solicitud(self, solicitud: Solicitud) -> bool:
+        # Comprobación y descuento atómicos por libro: seguro desde varios hilos, el stock nunca queda negativo
+        with self._cerrojo_libro(solicitud.libro_id):
+            # La búsqueda va dentro del cerrojo: con CatalogoSQLite el libro puede desalojarse y recargarse
+            libro = self.catalogo.get(solicitud.libro_id)
+            if libro is not None and libro.ejemplares_disponibles > 0:
+                libro.ejemplares_disponibles -= 1
+                solicitud.resultado = "éxito"
+            elif solicitud.tipo == 'reserva' and libro:
+                solicitud.resultado = "en_espera"
+                heapq.heappush(self.listas_espera.setdefault(solicitud.libro_id, []), solicitud)
+            else:
+                solicitud.resultado = "sin_ejemplares"
+            solicitud.procesada = True
+
+        with self._cerrojo_registro:
+            self._solicitudes_procesadas.append(solicitud)
+        return solicitud.resultado == "éxito"
+
+    def procesar_solicitudes_concurrente(self, hilos: Optional[int] = None):
+        # Cada tarea resuelve la cola completa de un libro bajo el cerrojo de su franja; el resultado
+        # es idéntico al procesamiento secuencial por libro
+        print(f"Procesando solicitudes con {hilos or 'auto'} hilos...")
+        colas: Dict[str, List[Solicitud]] = {}
+        for solicitud in self.solicitudes_heap:
+            colas.setdefault(solicitud.libro_id, []).append(solicitud)
+        self.solicitudes_heap = []
+
+        def resolver(elemento: Tuple[str, List[Solicitud]]) -> int:
+            libro_id, cola = elemento
+            with self._cerrojo_libro(libro_id):
+                return self._resolver_cola_libro(libro_id, cola)
+
+        with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+            exitosas = sum(ejecutor.map(resolver, colas.items()))
+
+        with self._cerrojo_registro:
+            self._colas_sin_fusionar.extend(colas.values())
+
+        procesadas = sum(len(cola) for cola in colas.values())
+        print(f"Procesamiento completado: {procesadas} solicitudes, {exitosas} exitosas")
+
+    def obtener_lista_espera(self, libro_id: str) -> List[Solicitud]:
+        return sorted(self.listas_espera.get(libro_id, []), key=_clave_solicitud)
+
+    @property
+    def solicitudes_procesadas(self) -> List[Solicitud]:
+        # El orden global de procesamiento se reconstruye solo cuando alguien lo consulta
+        if self._colas_sin_fusionar:
+            with self._cerrojo_registro:
+                colas = [sorted(cola, key=_clave_solicitud) for cola in self._colas_sin_fusionar]
+                self._solicitudes_procesadas.extend(heapq.merge(*colas, key=_clave_solicitud))
+                self._colas_sin_fusionar = []
+        return self._solicitudes_procesadas
+
+    @solicitudes_procesadas.setter
+    def solicitudes_procesadas(self, solicitudes: List[Solicitud]):
+        self._solicitudes_procesadas = list(solicitudes)
+        self._colas_sin_fusionar = []
+
+    @property
+    def indice_recomendaciones(self) -> IndiceRecomendaciones:
+        if self._indice_recomendaciones is None:
+            self._indice_recomendaciones = IndiceRecomendaciones(self.catalogo)
+        return self._indice_recomendaciones
+
+    def invalidar_indice_recomendaciones(self):
+        self._indice_recomendaciones = None
+        self.cache_recomendaciones.limpiar()
+
+    def agregar_libro(self, libro: Libro):
+        if libro.id in self.catalogo:
+            self.eliminar_libro(libro.id)
+
+        self.catalogo[libro.id] = libro
+        self._indice_recomendaciones = None
+        # Las entradas que ya referenciaban este id (aún sin resolver) pueden alcanzarlo ahora
+        self.cache_recomendaciones.invalidar(libro.id)
+        for indice in self.indices_catalogo.values():
+            indice.agregar(libro)
+        if self._indice_busqueda is not None:
+            self._indice_busqueda.agregar(libro)
+
+    def eliminar_libro(self, libro_id: str) -> Optional[Libro]:
+        libro = self.catalogo.pop(libro_id, None)
+        if libro is not None:
+            self._indice_recomendaciones = None
+            self.cache_recomendaciones.invalidar(libro_id)
+            for indice in self.indices_catalogo.values():
+                indice.eliminar(libro_id)
+            if self._indice_busqueda is not None:
+                self._indice_busqueda.eliminar(libro_id)
+        return libro
+
+    def actualizar_libro(self, libro_id: str, **cambios):
+        libro = self.catalogo[libro_id]
+        recomendaciones = cambios.pop('recomendaciones', None)
+        for atributo, valor in cambios.items():
+            if not hasattr(libro, atributo):
+                raise AttributeError(f"Libro no tiene el atributo '{atributo}'")
+            setattr(libro, atributo, valor)
+
+        if recomendaciones is not None:
+            self.actualizar_recomendaciones(libro_id, recomendaciones)
+        elif 'titulo' in cambios or 'anio' in cambios:
+            # Las filas de reporte en caché copian titulo y anio
+            self.cache_recomendaciones.invalidar(libro_id)
+        if 'popularidad' in cambios:
+            # El índice CSR guarda las popularidades y sus cotas para el ranking
+            self._indice_recomendaciones = None
+
+        for indice in self.indices_catalogo.values():
+            indice.actualizar(libro)
+        if self._indice_busqueda is not None:
+            self._indice_busqueda.agregar(libro)
+
+    def actualizar_recomendaciones(self, libro_id: str, recomendaciones: List[str]):
+        libro = self.catalogo[libro_id]
+        libro.recomendaciones = list(recomendaciones)
+        self._indice_recomendaciones = None
+        self.cache_recomendaciones.invalidar(libro_id)
+
     def obtener_recomendaciones(self, libro_id: str, profundidad_maxima: int = 3) -> List[str]:
+        return [rec_id for rec_id, _ in self.obtener_recomendaciones_con_distancia(libro_id, profundidad_maxima)]
+
+    def obtener_recomendaciones_con_distancia(self, libro_id: str,
+                                              profundidad_maxima: int = 3) -> List[Tuple[str, int]]:
         if libro_id not in self.catalogo:
             return []
 
-        recomendaciones = set()
-        self._buscar_recomendaciones_recursivo(libro_id, recomendaciones, profundidad_maxima, 0)
-        return list(recomendaciones)
+        return list(self._consultar_recomendaciones(libro_id, profundidad_maxima)['resultado'])
 
-    def _buscar_recomendaciones_recursivo(self, libro_id: str, recomendaciones: Set[str],
-                                          profundidad_maxima: int, profundidad_actual: int):
-        if profundidad_actual >= profundidad_maxima or libro_id not in self.catalogo:
-            return
+    def _consultar_recomendaciones(self, libro_id: str, profundidad_maxima: int) -> Dict[str, Any]:
+        clave = (libro_id, profundidad_maxima)
+        entrada = self.cache_recomendaciones.obtener(clave)
+        if entrada is not None:
+            return entrada
 
-        libro = self.catalogo[libro_id]
+        resultado = self.indice_recomendaciones.recorrer(libro_id, profundidad_maxima)
+
+        # Depende del origen, de cada libro alcanzado y de los ids que referencian los libros expandidos
+        dependencias = {libro_id}
+        dependencias.update(self.catalogo[libro_id].recomendaciones)
+        for rec_id, distancia in resultado:
+            dependencias.add(rec_id)
+            if distancia < profundidad_maxima:
+                dependencias.update(self.catalogo[rec_id].recomendaciones)
+
+        return self.cache_recomendaciones.guardar(clave, resultado, dependencias)
+
+    def obtener_estadisticas_cache(self) -> Dict[str, Any]:
+        return self.cache_recomendaciones.estadisticas()
+
+    def precalcular_recomendaciones(self, nombre_archivo: str, profundidades: Tuple[int, ...] = (1, 2, 3),
+                                    procesos: Optional[int] = None, tamano_lote: int = 256) -> Dict[str, int]:
+        global _INDICE_COMPARTIDO
+        completados = _reanudar_jsonl(nombre_archivo)
+        pendientes = [libro_id for libro_id in self.catalogo if libro_id not in completados]
+        lotes = [pendientes[i:i + tamano_lote] for i in range(0, len(pendientes), tamano_lote)]
+        procesos = procesos or os.cpu_count() or 1
+        indice = self.indice_recomendaciones
+
+        start_time = time.time()
+
+        with open(nombre_archivo, 'a', encoding='utf-8') as archivo:
+            if procesos <= 1 or len(lotes) <= 1:
+                _INDICE_COMPARTIDO = indice
+                try:
+                    for lote in lotes:
+                        archivo.writelines(_recorrer_lote((lote, profundidades)))
+                        archivo.flush()
+                finally:
+                    _INDICE_COMPARTIDO = None
+            else:
+                # Con fork los procesos heredan el índice CSR sin serializarlo (copy-on-write)
+                if 'fork' in multiprocessing.get_all_start_methods():
+                    _INDICE_COMPARTIDO = indice
+                    opciones = {'mp_context': multiprocessing.get_context('fork')}
+                else:
+                    opciones = {'initializer': _inicializar_indice_compartido, 'initargs': (indice,)}
 
-        for recomendacion_id in libro.recomendaciones:
-            if recomendacion_id not in recomendaciones and recomendacion_id in self.catalogo:
-                recomendaciones.add(recomendacion_id)
-                self._buscar_recomendaciones_recursivo(
-                    recomendacion_id, recomendaciones, profundidad_maxima, profundidad_actual + 1
-                )
+                try:
+                    with ProcessPoolExecutor(max_workers=min(procesos, len(lotes)), **opciones) as ejecutor:
+                        for lineas in ejecutor.map(_recorrer_lote, [(lote, profundidades) for lote in lotes]):
+                            archivo.writelines(lineas)
+                            archivo.flush()
+                finally:
+                    _INDICE_COMPARTIDO = None
+
+        end_time = time.time()
+        print(f"Recomendaciones precalculadas: {len(pendientes)} libros "
+              f"({len(completados)} ya existentes) en {end_time - start_time:.4f} segundos")
+
+        return {'procesados': len(pendientes), 'omitidos': len(completados)}
+
+    def indice_catalogo(self, criterio: str = 'titulo') -> IndiceOrdenado:
+        indice = self.indices_catalogo.get(criterio)
+        if indice is None:
+            _, primero_descendente = _parsear_criterio(criterio)[0]
+            indice = IndiceOrdenado(lambda libro: libro.clave_orden(criterio),
+                                    codificar_limite=lambda valor: _codificar_campo(valor, primero_descendente))
+            indice.construir(self.catalogo.values())
+            self.indices_catalogo[criterio] = indice
+        return indice
+
+    def obtener_pagina_catalogo(self, criterio: str = 'titulo', desplazamiento: int = 0, limite: int = 50,
+                                descendente: bool = False) -> List[Libro]:
+        return [self.catalogo[libro_id] for libro_id
+                in self.indice_catalogo(criterio).pagina(desplazamiento, limite, descendente)]
+
+    def obtener_rango_catalogo(self, criterio: str, desde: Any, hasta: Any) -> List[Libro]:
+        return [self.catalogo[libro_id] for libro_id in self.indice_catalogo(criterio).rango(desde, hasta)]
+
+    @property
+    def indice_busqueda(self) -> IndiceBusqueda:
+        if self._indice_busqueda is None:
+            self._indice_busqueda = IndiceBusqueda()
+            self._indice_busqueda.construir(self.catalogo.values())
+        return self._indice_busqueda
+
+    def buscar(self, consulta: str, limite: Optional[int] = None) -> List[Libro]:
+        ids = self.indice_busqueda.consultar(consulta, self.catalogo)
+        if limite is not None:
+            ids = heapq.nsmallest(limite, ids, key=lambda libro_id: self.catalogo[libro_id].clave_orden('titulo'))
+        else:
+            ids = sorted(ids, key=lambda libro_id: self.catalogo[libro_id].clave_orden('titulo'))
+        return [self.catalogo[libro_id] for libro_id in ids]
+
+    def buscar_por_prefijo_titulo(self, prefijo: str, limite: int = 20) -> List[Libro]:
+        return [self.catalogo[libro_id] for libro_id in self.indice_busqueda.prefijo_titulo(prefijo, limite)]
 
     def ordenar_catalogo(self, criterio: str = 'titulo', algoritmo: str = 'quicksort'):
+        _parsear_criterio(criterio)
         libros = list(self.catalogo.values())
 
         start_time = time.time()
@@ -135,6 +1342,8 @@ class SistemaBiblioteca:
             libros_ordenados = self.quicksort_iterativo(libros, criterio)
         elif algoritmo == 'mergesort':
             libros_ordenados = self.mergesort(libros, criterio)
+        elif algoritmo == 'timsort':
+            libros_ordenados = sorted(libros, key=lambda libro: libro.clave_orden(criterio))
         else:
             raise ValueError("Algoritmo no soportado")
 
@@ -167,11 +1376,11 @@ class SistemaBiblioteca:
         return arr_copy
 
     def _partition(self, arr: List[Any], low: int, high: int, criterio: str) -> int:
-        pivot = arr[high]
+        pivot_key = arr[high].clave_orden(criterio)
         i = low - 1
 
         for j in range(low, high):
-            if self._comparar_libros(arr[j], pivot, criterio) <= 0:
+            if arr[j].clave_orden(criterio) <= pivot_key:
                 i += 1
                 arr[i], arr[j] = arr[j], arr[i]
 
@@ -193,7 +1402,7 @@ class SistemaBiblioteca:
         i = j = 0
 
         while i < len(left) and j < len(right):
-            if self._comparar_libros(left[i], right[j], criterio) <= 0:
+            if left[i].clave_orden(criterio) <= right[j].clave_orden(criterio):
                 result.append(left[i])
                 i += 1
             else:
@@ -205,18 +1414,9 @@ class SistemaBiblioteca:
         return result
 
     def _comparar_libros(self, libro1: Libro, libro2: Libro, criterio: str) -> int:
-        if criterio == 'titulo':
-            if libro1.titulo != libro2.titulo:
-                return -1 if libro1.titulo < libro2.titulo else 1
-            return libro1.anio - libro2.anio
-
-        elif criterio == 'anio':
-            if libro1.anio != libro2.anio:
-                return libro1.anio - libro2.anio
-            return -1 if libro1.titulo < libro2.titulo else 1
-
-        else:
-            raise ValueError("Criterio de ordenamiento no válido")
+        clave1 = libro1.clave_orden(criterio)
+        clave2 = libro2.clave_orden(criterio)
+        return (clave1 > clave2) - (clave1 < clave2)
 
     def generar_reporte_solicitudes(self) -> List[Dict[str, Any]]:
         reporte = []
@@ -232,29 +1432,77 @@ class SistemaBiblioteca:
             })
         return reporte
 
-    def generar_reporte_recomendaciones(self, libro_id: str, profundidad: int = 2) -> Dict[str, Any]:
+    def generar_reporte_recomendaciones(self, libro_id: str, profundidad: int = 2,
+                                        solo_disponibles: bool = False) -> Dict[str, Any]:
         if libro_id not in self.catalogo:
             return {'error': 'Libro no encontrado'}
 
-        recomendaciones = self.obtener_recomendaciones(libro_id, profundidad)
+        entrada = self._consultar_recomendaciones(libro_id, profundidad)
+        if entrada['filas'] is None:
+            entrada['filas'] = [
+                {
+                    'id': rec_id,
+                    'titulo': self.catalogo[rec_id].titulo,
+                    'anio': self.catalogo[rec_id].anio,
+                    'distancia': distancia
+                } for rec_id, distancia in entrada['resultado']
+            ]
+
+        filas = entrada['filas']
+        if solo_disponibles:
+            filas = [fila for fila in filas if self.catalogo[fila['id']].ejemplares_disponibles > 0]
 
         return {
             'libro_origen': libro_id,
             'titulo_origen': self.catalogo[libro_id].titulo,
             'profundidad': profundidad,
+            'recomendaciones': [dict(fila) for fila in filas],
+            'total_recomendaciones': len(filas)
+        }
+
+    def obtener_recomendaciones_ranking(self, libro_id: str, k: int = 10, decaimiento: float = 0.5,
+                                        profundidad_maxima: Optional[int] = 3,
+                                        solo_disponibles: bool = False) -> List[Tuple[str, int, float]]:
+        if not 0 < decaimiento <= 1:
+            raise ValueError(f"Decaimiento no válido: {decaimiento}")
+        if libro_id not in self.catalogo:
+            return []
+
+        admitir = None
+        if solo_disponibles:
+            admitir = lambda rec_id: self.catalogo[rec_id].ejemplares_disponibles > 0
+        return self.indice_recomendaciones.recorrer_ponderado(libro_id, k, decaimiento, profundidad_maxima, admitir)
+
+    def generar_reporte_recomendaciones_ranking(self, libro_id: str, k: int = 10, decaimiento: float = 0.5,
+                                                profundidad_maxima: Optional[int] = 3,
+                                                solo_disponibles: bool = False) -> Dict[str, Any]:
+        if libro_id not in self.catalogo:
+            return {'error': 'Libro no encontrado'}
+
+        ranking = self.obtener_recomendaciones_ranking(libro_id, k, decaimiento, profundidad_maxima, solo_disponibles)
+
+        return {
+            'libro_origen': libro_id,
+            'titulo_origen': self.catalogo[libro_id].titulo,
+            'profundidad': profundidad_maxima,
+            'decaimiento': decaimiento,
             'recomendaciones': [
                 {
                     'id': rec_id,
                     'titulo': self.catalogo[rec_id].titulo,
-                    'anio': self.catalogo[rec_id].anio
-                } for rec_id in recomendaciones
+                    'anio': self.catalogo[rec_id].anio,
+                    'distancia': distancia,
+                    'puntuacion': round(puntuacion, 4)
+                } for rec_id, distancia, puntuacion in ranking
             ],
-            'total_recomendaciones': len(recomendaciones)
+            'total_recomendaciones': len(ranking)
         }
 
     def generar_reporte_catalogo_ordenado(self, max_libros: int = 50) -> List[Dict[str, Any]]:
-        if not self.libros_ordenados:
-            self.ordenar_catalogo('titulo', 'quicksort')
+        if self.libros_ordenados:
+            libros = self.libros_ordenados[:max_libros]
+        else:
+            libros = self.obtener_pagina_catalogo('titulo', 0, max_libros)
 
         return [
             {
@@ -262,7 +1510,7 @@ class SistemaBiblioteca:
                 'titulo': libro.titulo,
                 'anio': libro.anio,
                 'ejemplares_disponibles': libro.ejemplares_disponibles
-            } for libro in self.libros_ordenados[:max_libros]
+            } for libro in libros
         ]
 
     def guardar_reportes(self, prefijo_archivo: str = "reporte"):
@@ -280,13 +1528,114 @@ class SistemaBiblioteca:
         print(f"Reportes guardados con prefijo: {prefijo_archivo}")
 
 
+def _inicializar_indice_compartido(indice: IndiceRecomendaciones):
+    global _INDICE_COMPARTIDO
+    _INDICE_COMPARTIDO = indice
+
+
+def _recorrer_lote(tarea: Tuple[List[str], Tuple[int, ...]]) -> List[str]:
+    libros, profundidades = tarea
+    profundidad_maxima = max(profundidades)
+    lineas = []
+
+    for libro_id in libros:
+        # Un solo BFS a la profundidad máxima: el resultado de cada profundidad menor es un prefijo
+        resultado = _INDICE_COMPARTIDO.recorrer(libro_id, profundidad_maxima)
+        recomendaciones = {}
+        for profundidad in profundidades:
+            recomendaciones[str(profundidad)] = [[rec_id, distancia] for rec_id, distancia in resultado
+                                                 if distancia <= profundidad]
+        lineas.append(json.dumps({'libro_id': libro_id, 'recomendaciones': recomendaciones},
+                                 ensure_ascii=False) + '\n')
+
+    return lineas
+
+
+def _reanudar_jsonl(nombre_archivo: str) -> Set[str]:
+    # Devuelve los libros ya escritos y trunca una última línea incompleta de una ejecución interrumpida
+    completados = set()
+    if not os.path.exists(nombre_archivo):
+        return completados
+
+    posicion_valida = 0
+    with open(nombre_archivo, 'rb+') as archivo:
+        for linea in archivo:
+            if not linea.endswith(b'\n'):
+                break
+            try:
+                completados.add(json.loads(linea)['libro_id'])
+            except (ValueError, KeyError):
+                break
+            posicion_valida += len(linea)
+        archivo.truncate(posicion_valida)
+
+    return completados
+
+
+def prueba_estres_concurrente(archivo_catalogo: str = 'catalogo.json', total_solicitudes: int = 200000,
+                              hilos: Tuple[int, ...] = (1, 2, 4, 8), semilla: int = 42) -> List[Dict[str, Any]]:
+    # Atiende el mismo lote aleatorio con distintos números de hilos vía atender_solicitud y verifica
+    # que ningún libro entregue más ejemplares de los que tenía
+    resultados = []
+
+    for numero_hilos in hilos:
+        sistema = SistemaBiblioteca()
+        sistema.cargar_catalogo(archivo_catalogo)
+        stock_inicial = {libro_id: libro.ejemplares_disponibles for libro_id, libro in sistema.catalogo.items()}
+        libros = list(sistema.catalogo)
+
+        generador = random.Random(semilla)
+        solicitudes = [Solicitud({
+            'id': f"EST{i:07d}",
+            'usuario_id': f"U{generador.randrange(10000):05d}",
+            'libro_id': generador.choice(libros),
+            'prioridad': generador.randint(1, 5),
+            'timestamp': "2025-01-01T00:00:00Z",
+            'tipo': generador.choice(('prestamo', 'lectura_sala', 'reserva'))
+        }) for i in range(total_solicitudes)]
+        porciones = [solicitudes[i::numero_hilos] for i in range(numero_hilos)]
+
+        def atender(porcion: List[Solicitud]) -> int:
+            return sum(sistema.atender_solicitud(solicitud) for solicitud in porcion)
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=numero_hilos) as ejecutor:
+            exitosas = sum(ejecutor.map(atender, porciones))
+        tiempo = time.time() - start_time
+
+        exitosas_por_libro: Dict[str, int] = {}
+        for solicitud in solicitudes:
+            if solicitud.resultado == "éxito":
+                exitosas_por_libro[solicitud.libro_id] = exitosas_por_libro.get(solicitud.libro_id, 0) + 1
+        sobrevendidos = [
+            libro_id for libro_id, libro in sistema.catalogo.items()
+            if libro.ejemplares_disponibles < 0
+            or exitosas_por_libro.get(libro_id, 0) > stock_inicial[libro_id]
+            or libro.ejemplares_disponibles != stock_inicial[libro_id] - exitosas_por_libro.get(libro_id, 0)
+        ]
+
+        resultado = {
+            'hilos': numero_hilos,
+            'solicitudes': total_solicitudes,
+            'exitosas': exitosas,
+            'segundos': tiempo,
+            'solicitudes_por_segundo': total_solicitudes / tiempo if tiempo > 0 else float('inf'),
+            'libros_sobrevendidos': sobrevendidos
+        }
+        resultados.append(resultado)
+        print(f"{numero_hilos} hilos: {resultado['solicitudes_por_segundo']:.0f} solicitudes/s, "
+              f"{exitosas} exitosas, sobrevendidos: {len(sobrevendidos)}")
+
+    return resultados
+
+
 def main():
     sistema = SistemaBiblioteca()
 
     sistema.cargar_catalogo('catalogo.json')
     sistema.cargar_solicitudes('solicitudes.json')
 
-    sistema.procesar_solicitudes()
+    sistema.procesar_solicitudes_por_libro()
 
     print("\nComparando algoritmos de ordenamiento:")
 
@@ -294,11 +1643,14 @@ def main():
 
     libros_mergesort, tiempo_mergesort = sistema.ordenar_catalogo('titulo', 'mergesort')
 
+    libros_timsort, tiempo_timsort = sistema.ordenar_catalogo('titulo', 'timsort')
+
     libros_quicksort_anio, tiempo_quicksort_anio = sistema.ordenar_catalogo('anio', 'quicksort')
 
     print(f"\nResultados de ordenamiento:")
     print(f"QuickSort (título): {tiempo_quicksort:.4f} segundos")
     print(f"MergeSort (título): {tiempo_mergesort:.4f} segundos")
+    print(f"Timsort (título): {tiempo_timsort:.4f} segundos")
     print(f"QuickSort (año): {tiempo_quicksort_anio:.4f} segundos")
 
     if sistema.catalogo:
@@ -306,6 +1658,9 @@ def main():
         recomendaciones = sistema.generar_reporte_recomendaciones(ejemplo_libro_id)
         print(f"\nRecomendaciones para '{sistema.catalogo[ejemplo_libro_id].titulo}':")
         print(f"Encontradas {recomendaciones['total_recomendaciones']} recomendaciones")
+        ranking = sistema.generar_reporte_recomendaciones_ranking(ejemplo_libro_id, k=5)
+        print("Top 5 por popularidad y distancia: " +
+              ", ".join(f"{rec['titulo']} ({rec['puntuacion']})" for rec in ranking['recomendaciones']))
 
     sistema.guardar_reportes()
 
@@ -314,19 +1669,36 @@ def main():
     print("=" * 60)
     print("1. Estructuras de datos:")
     print("   - Catálogo (diccionario): O(1) acceso por ID")
+    print("   - Catálogo SQLite: O(log n) por acceso fuera del LRU, memoria acotada por la capacidad del LRU")
     print("   - Cola de prioridad (min-heap): O(log n) inserción/extracción")
     print()
     print("2. Algoritmos de ordenamiento:")
     print("   - QuickSort iterativo: O(n log n) promedio, O(n²) peor caso")
     print("   - MergeSort: O(n log n) en todos los casos, O(n) espacio")
+    print("   - Timsort con claves de colación precalculadas: O(n log n), comparaciones de tuplas en C")
+    print("   - Índices ordenados por bloques (titulo, anio): O(log n) búsqueda, O(log n + B) inserción/borrado con bloques de tamaño B")
+    print("   - Página, rango y top-N desde el índice: O(log n + k) sin reordenar")
     print()
     print("3. Búsqueda de recomendaciones:")
-    print("   - Recorrido en profundidad: O(b^d) donde b es el factor de ramificación")
-    print("   - Memoria: O(d) para la pila de recursión")
+    print("   - Índice CSR construido una vez: O(V + E)")
+    print("   - BFS por niveles: O(V + E) sobre la vecindad alcanzada, sin recursión")
+    print("   - Ranking top-k: heap acotado O(log k) por candidato, poda por cota de popularidad y distancia")
+    print("   - Precálculo del catálogo completo: O(V · (V + E)) repartido entre procesos")
     print()
     print("4. Procesamiento de solicitudes:")
     print("   - Para n solicitudes: O(n log n) por la cola de prioridad")
+    print("   - Por libro: O(n) si el stock cubre o se agota la cola; O(m log m) solo en libros con corte parcial")
+    print("   - Orden global reconstruido bajo demanda con k-way merge: O(n log k)")
+    print("   - Devolución: O(log r) para asignar el ejemplar a la mejor reserva en espera")
+    print("   - Modo concurrente: cerrojos por franjas de libro_id, sin contención entre libros distintos")
+    print()
+    print("5. Búsqueda en el catálogo:")
+    print("   - Índice invertido de tokens: O(1) por token, intersección desde el conjunto más pequeño")
+    print("   - Prefijo de título y rangos numéricos sobre índices ordenados: O(log n + k)")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if '--estres' in sys.argv:
+        prueba_estres_concurrente()
+    else:
+        main()
\ No newline at end of file